@@ -0,0 +1,21 @@
+from typing import Iterator, Tuple
+from config import *
+
+
+def length_chunk_count(length: int) -> int:
+    return (36 ** length + CHUNK_SIZE - 1) // CHUNK_SIZE
+
+
+def chunk_count(min_length: int, max_length: int) -> int:
+    return sum(length_chunk_count(length) for length in range(min_length, max_length + 1))
+
+
+def candidate_count(min_length: int, max_length: int) -> int:
+    return sum(36 ** length for length in range(min_length, max_length + 1))
+
+
+def generate_chunks(min_length: int, max_length: int) -> Iterator[Tuple[int, int, int]]:
+    for length in range(min_length, max_length + 1):
+        total = 36 ** length
+        for start in range(0, total, CHUNK_SIZE):
+            yield length, start, min(start + CHUNK_SIZE, total)
@@ -1,14 +1,45 @@
 from typing import List
 
-WORKER_URLS: List[str] = ['http://lab1-worker-1:8080', 'http://lab1-worker-2:8080', 'http://lab1-worker-3:8080']
 MANAGER_PORT: int = 8080
 RETRY_COUNT: int = 3
 RETRY_TIMEOUT_SECONDS: int = 3
+HEALTHCHECK_SECONDS: int = 3
+HEALTH_STALE_SECONDS: float = 10
+HTTP_POOL_SIZE: int = 100
 REQUEST_TIMEOUT: int = 30000
+# Finished requests are forgotten this long after their last update
+REQUEST_RETENTION_SECONDS: float = 3600
+MD5_HEX_LENGTH: int = 32
+# Bounds the keyspace arithmetic done on every submit
+MAX_LENGTH: int = 12
+MAX_BATCH_SIZE: int = 1000
+MAX_ACTIVE_REQUESTS: int = 8
+SCHEDULER_SECONDS: float = 1
+DEFAULT_PRIORITY: int = 0
+MAX_PRIORITY: int = 9
+PRIORITY_AGING_SECONDS: float = 60
+MAX_QUEUED_REQUESTS: int = 1000
+MAX_BACKLOG_SECONDS: float = 3600
+ADMISSION_RETRY_SECONDS: int = 10
+MAX_STATUS_BATCH_SIZE: int = 10000
+CHUNK_SIZE: int = 36 ** 5
+RESULT_CACHE_SIZE: int = 10000
+ALPHABET: str = 'abcdefghijklmnopqrstuvwxyz0123456789'
+STATUS_CACHE_SECONDS: float = 1
+STATUS_CACHE_SIZE: int = 10000
+STATUS_STREAM_SECONDS: float = 1
+STATUS_STREAM_KEEPALIVE_SECONDS: float = 15
 
 WORKER_HEALTH_URL = "/health"
 WORKER_TASK_URL = "/internal/api/worker/hash/crack/task"
 WORKER_PROGRESS_URL = "/progress"
+WORKER_CANCEL_URL = "/internal/api/worker/hash/crack/cancel"
 MANAGER_CRACK_URL = "/api/hash/crack"
+MANAGER_CRACK_BATCH_URL = "/api/hash/crack/batch"
 MANAGER_STATUS_URL = "/api/hash/status"
-MANAGER_PATCH_URL = "/internal/api/manager/hash/crack/request"
\ No newline at end of file
+MANAGER_STATUS_STREAM_URL = "/api/hash/status/stream"
+MANAGER_STATUS_BATCH_URL = "/api/hash/status/batch"
+MANAGER_PATCH_URL = "/internal/api/manager/hash/crack/request"
+MANAGER_PROGRESS_URL = "/internal/api/manager/hash/crack/progress"
+MANAGER_HEARTBEAT_URL = "/internal/api/manager/workers/heartbeat"
+MANAGER_WORKERS_URL = "/api/workers"
\ No newline at end of file
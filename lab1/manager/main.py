@@ -4,8 +4,14 @@ if __name__ == '__main__':
     manager = Manager()
     app = web.Application()
     app.router.add_post(MANAGER_CRACK_URL, manager.handle_crack_hash)
+    app.router.add_post(MANAGER_CRACK_BATCH_URL, manager.handle_crack_batch)
     app.router.add_get(MANAGER_STATUS_URL, manager.handle_get_status)
+    app.router.add_get(MANAGER_STATUS_STREAM_URL, manager.handle_status_stream)
+    app.router.add_post(MANAGER_STATUS_BATCH_URL, manager.handle_get_status_batch)
     app.router.add_patch(MANAGER_PATCH_URL, manager.handle_patch_request)
+    app.router.add_post(MANAGER_PROGRESS_URL, manager.handle_progress)
+    app.router.add_post(MANAGER_HEARTBEAT_URL, manager.handle_heartbeat)
+    app.router.add_get(MANAGER_WORKERS_URL, manager.handle_get_workers)
 
     app.on_startup.append(manager.start_background_tasks)
     app.on_cleanup.append(manager.cleanup_background_tasks)
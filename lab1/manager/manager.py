@@ -3,10 +3,15 @@ from aiohttp import web
 import uuid
 import time
 import asyncio
-import xml.etree.ElementTree as ET
+import json
 import logging
-from typing import Dict, Any, Optional
+import math
+import string
+from typing import Dict, Any, List, Optional, Set, Tuple
+from collections import OrderedDict
 from config import *
+from chunks import candidate_count, chunk_count, generate_chunks
+from protocol import load_results
 from enum import Enum
 
 logging.basicConfig(
@@ -23,32 +28,120 @@ class Status(Enum):
 class RequestStore:
     def __init__(self):
         self.requests: Dict[str, Dict[str, Any]] = {}
+        self.results_cache: OrderedDict = OrderedDict()
+        self.active_requests: Dict[Tuple[str, int, str], str] = {}
+        self.searched: OrderedDict = OrderedDict()
         self.lock: asyncio.Lock = asyncio.Lock()
 
-    async def create_request(self, request_id: str, part_count: int) -> None:
+    async def create_request(self, request_id: str, part_count: int, hash_target: str, max_length: int,
+                             stop_on_first_match: bool = False, priority: int = DEFAULT_PRIORITY) -> Optional[str]:
+        """Insert a request; returns the id of a request that already serves the key instead, if there is one."""
         async with self.lock:
+            # Checked again under the lock: the handler awaits between its own
+            # lookup and this insert, and an identical submission may have won.
+            known_id = self._find_known_request(hash_target, max_length)
+            if known_id:
+                return known_id
             self.requests[request_id] = {
+                'request_id': request_id,
                 'status': Status.NEW.value,
                 'results': [],
                 'parts_received': 0,
+                'parts_done': set(),
                 'part_count': part_count,
+                'candidates_done': 0,
+                'candidates_total': candidate_count(1, max_length),
                 'start_time': time.time(),
-                'timeout': REQUEST_TIMEOUT
+                'updated_at': time.time(),
+                'timeout': REQUEST_TIMEOUT,
+                'key': (hash_target, max_length, ALPHABET),
+                'stop_on_first_match': stop_on_first_match,
+                'priority': priority
             }
+            # A stop-on-first-match run may end early, so an exhaustive
+            # submission must not be attached to it.
+            if not stop_on_first_match:
+                self.active_requests[(hash_target, max_length, ALPHABET)] = request_id
+            return None
+
+    def _find_known_request(self, hash_target: str, max_length: int) -> Optional[str]:
+        # A READY hit answers with the request that found it, as in lab2.
+        key = (hash_target, max_length, ALPHABET)
+        if key in self.results_cache:
+            self.results_cache.move_to_end(key)
+            return self.results_cache[key]
+        return self.active_requests.get(key)
+
+    async def find_known_request(self, hash_target: str, max_length: int) -> Optional[str]:
+        async with self.lock:
+            return self._find_known_request(hash_target, max_length)
+
+    def _finish_request(self, request_id: str, status: str, exhausted: bool = True) -> None:
+        request = self.requests[request_id]
+        request['status'] = status
+        request['updated_at'] = time.time()
+        if self.active_requests.get(request['key']) == request_id:
+            del self.active_requests[request['key']]
+        # Only a search over the whole keyspace may answer later submissions.
+        if status == Status.READY.value and exhausted:
+            self.results_cache[request['key']] = request_id
+            self.results_cache.move_to_end(request['key'])
+            if len(self.results_cache) > RESULT_CACHE_SIZE:
+                self.results_cache.popitem(last=False)
+            hash_target, max_length, alphabet = request['key']
+            self._record_searched(hash_target, max_length, request['results'])
+
+    def _record_searched(self, hash_target: str, max_length: int, results: List[str]) -> None:
+        key = (hash_target, ALPHABET)
+        searched = self.searched.get(key, {'max_length': 0, 'results': []})
+        self.searched[key] = {
+            'max_length': max(searched['max_length'], max_length),
+            'results': searched['results'] + [result for result in results if result not in searched['results']]
+        }
+        self.searched.move_to_end(key)
+        if len(self.searched) > RESULT_CACHE_SIZE:
+            self.searched.popitem(last=False)
+
+    async def get_searched(self, hash_targets: List[str]) -> Dict[str, Dict[str, Any]]:
+        async with self.lock:
+            return {
+                hash_target: self.searched[(hash_target, ALPHABET)]
+                for hash_target in hash_targets if (hash_target, ALPHABET) in self.searched
+            }
+
+    async def add_results(self, request_id: str, results: List[str]) -> None:
+        async with self.lock:
+            request = self.requests[request_id]
+            for result in results:
+                if result not in request['results']:
+                    request['results'].append(result)
+            request['updated_at'] = time.time()
+
+    async def finish_requests(self, request_ids: List[str], exhausted: bool = True) -> None:
+        async with self.lock:
+            for request_id in request_ids:
+                self._finish_request(request_id, Status.READY.value, exhausted)
 
-    async def update_request(self, request_id: str, results: List[str], partial: str) -> None:
+    async def update_request(self, request_id: str, part_number: int, results: List[str], partial: bool) -> bool:
         async with self.lock:
             if request_id not in self.requests:
-                return
+                return False
             request = self.requests[request_id]
             if request['status'] == Status.IN_PROGRESS.value:
+                request['updated_at'] = time.time()
                 for result in results:
                     if result not in request['results']:
                         request['results'].append(result)
-                if partial == "False":
-                    request['parts_received'] += 1
+                if request['stop_on_first_match'] and request['results']:
+                    self._finish_request(request_id, Status.READY.value, exhausted=False)
+                    return True
+                if not partial:
+                    # A retried chunk may report twice; count each part once.
+                    request['parts_done'].add(part_number)
+                    request['parts_received'] = len(request['parts_done'])
                     if request['parts_received'] >= request['part_count']:
-                        request['status'] = Status.READY.value
+                        self._finish_request(request_id, Status.READY.value)
+            return False
 
     async def check_timeouts(self) -> None:
         async with self.lock:
@@ -56,154 +149,490 @@ class RequestStore:
             for req_id, req in self.requests.items():
                 if req['status'] == Status.IN_PROGRESS.value:
                     if current_time - req['start_time'] > req['timeout']:
-                        req['status'] = Status.ERROR.value
+                        self._finish_request(req_id, Status.ERROR.value)
+            expired = {req_id for req_id, req in self.requests.items()
+                       if req['status'] in [Status.READY.value, Status.ERROR.value]
+                       and current_time - req['updated_at'] > REQUEST_RETENTION_SECONDS}
+            if not expired:
+                return
+            for req_id in expired:
+                del self.requests[req_id]
+            # The searched lengths are kept per hash and outlive the requests.
+            for key in [key for key, req_id in self.results_cache.items() if req_id in expired]:
+                del self.results_cache[key]
 
     async def get_request(self, request_id: str) -> Optional[Dict[str, Any]]:
         async with self.lock:
             return self.requests.get(request_id)
 
+    async def get_requests(self, request_ids: List[str], changed_since: float = 0) -> Dict[str, Dict[str, Any]]:
+        async with self.lock:
+            return {
+                request_id: self.requests[request_id]
+                for request_id in request_ids
+                if request_id in self.requests and self.requests[request_id]['updated_at'] > changed_since
+            }
+
+    async def set_status_many(self, request_ids: List[str], status: str) -> None:
+        async with self.lock:
+            for request_id in request_ids:
+                self.requests[request_id]['status'] = status
+                self.requests[request_id]['updated_at'] = time.time()
+
+    async def set_part_count(self, request_ids: List[str], part_count: int, candidates_total: int) -> None:
+        async with self.lock:
+            for request_id in request_ids:
+                self.requests[request_id]['part_count'] = part_count
+                self.requests[request_id]['candidates_total'] = candidates_total
+                self.requests[request_id]['updated_at'] = time.time()
+
+    async def add_progress(self, request_ids: List[str], count: int) -> None:
+        async with self.lock:
+            for request_id in request_ids:
+                if request_id in self.requests:
+                    self.requests[request_id]['candidates_done'] += count
+                    self.requests[request_id]['updated_at'] = time.time()
+
     async def mark_worker_failed(self, request_id: str) -> None:
         async with self.lock:
             if request_id in self.requests:
                 self.requests[request_id]['parts_received'] += 1
-                self.requests[request_id]['status'] = Status.ERROR.value
+                self._finish_request(request_id, Status.ERROR.value)
 
 class Manager:
     def __init__(self):
         self.request_store = RequestStore()
-        self.request_queue = asyncio.Queue()
+        self.status_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.streamed: Dict[str, Dict[str, Any]] = {}
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.workers: Dict[str, Dict[str, Any]] = {}
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.dispatchers: Dict[str, asyncio.Task] = {}
+        self.no_workers_since: Optional[float] = None
+        self.work_ready: Optional[asyncio.Event] = None
+        self.pending: List[Dict[str, Any]] = []
+        self.queue_positions: Dict[str, int] = {}
+
+    def live_workers(self) -> List[str]:
+        current_time = time.time()
+        return [url for url, worker in self.workers.items()
+                if current_time - worker['last_seen'] <= HEALTH_STALE_SECONDS]
+
+    def drop_worker(self, worker_url: str) -> None:
+        if self.workers.pop(worker_url, None):
+            logging.error(f"Worker {worker_url} left")
+
+    async def handle_heartbeat(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        url = data.get('url')
+        if not url:
+            return web.Response(status=400)
+        if data.get('leaving'):
+            self.drop_worker(url)
+            return web.Response(status=200)
+        if url not in self.workers:
+            logging.info(f"Worker {url} joined with {data.get('cores')} cores")
+        self.workers[url] = {
+            'cores': data.get('cores', 1),
+            'hash_rate': data.get('hash_rate', 0),
+            'last_seen': time.time()
+        }
+        return web.Response(status=200)
+
+    async def handle_get_workers(self, request: web.Request) -> web.Response:
+        live = set(self.live_workers())
+        return web.json_response({
+            'workers': [{'url': url, 'cores': worker['cores'], 'hash_rate': worker['hash_rate'],
+                         'last_seen': worker['last_seen'], 'alive': url in live}
+                        for url, worker in self.workers.items()],
+            'hash_rate': self.cluster_hash_rate()
+        })
 
-    async def check_worker_health(self, worker_url: str) -> bool:
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{worker_url}{WORKER_HEALTH_URL}") as response:
-                    return response.status == 200
-        except:
-            return False
+    async def health_monitor(self) -> None:
+        while True:
+            await asyncio.sleep(HEALTHCHECK_SECONDS)
+            current_time = time.time()
+            for url, worker in list(self.workers.items()):
+                if current_time - worker['last_seen'] > HEALTH_STALE_SECONDS:
+                    self.drop_worker(url)
 
     async def process_requests(self) -> None:
+        # Up to MAX_ACTIVE_REQUESTS jobs run at once; every live worker has one
+        # dispatcher that pulls chunks from all of them.
         while True:
+            for url in self.live_workers():
+                if url not in self.dispatchers or self.dispatchers[url].done():
+                    self.dispatchers[url] = asyncio.create_task(self.worker_dispatcher(url))
+
+            # A worker dropped after one failed send is back with its next
+            # heartbeat, and the chunk it lost waits in the job's retry list;
+            # jobs fail only once no worker has been seen for a while.
+            if self.live_workers():
+                self.no_workers_since = None
+            elif self.no_workers_since is None:
+                self.no_workers_since = time.time()
+            stranded = (self.no_workers_since is not None
+                        and time.time() - self.no_workers_since > HEALTH_STALE_SECONDS)
+
+            for job_id, job in list(self.jobs.items()):
+                if await self.requests_finished(job['request_ids']):
+                    del self.jobs[job_id]
+                elif stranded and (job['retry'] or not job['exhausted']):
+                    logging.error(f"No workers left for chunks of {', '.join(job['request_ids'])}")
+                    for request_id in job['request_ids']:
+                        await self.request_store.mark_worker_failed(request_id)
+
+            self.pending.sort(key=self.rank)
+            while self.pending and len(self.jobs) < MAX_ACTIVE_REQUESTS:
+                await self.start_job(self.pending.pop(0))
+            self.queue_positions = {request_id: position
+                                    for position, request_data in enumerate(self.pending, 1)
+                                    for request_id in request_data['targets'].values()}
+            await asyncio.sleep(SCHEDULER_SECONDS)
+
+    async def backlog(self) -> int:
+        # Candidates still to check in queued and running jobs; a batch is
+        # one pass over the keyspace, so its first request stands for it.
+        work = sum(request_data['cost'] for request_data in self.pending)
+        for job in self.jobs.values():
+            request_data = await self.request_store.get_request(job['request_ids'][0])
+            if request_data:
+                work += max(request_data['candidates_total'] - request_data['candidates_done'], 0)
+        return work
+
+    async def admit(self, cost: int) -> Tuple[Optional[int], Optional[float]]:
+        """Decide whether a new job of cost candidates can be queued.
+
+        Returns the Retry-After seconds for a refused job, or None and the
+        expected seconds until an admitted job is done (None while the
+        cluster rate is not measured yet).
+        """
+        rate = self.cluster_hash_rate()
+        backlog = await self.backlog()
+        queued = len(self.pending)
+        if queued >= MAX_QUEUED_REQUESTS:
+            # A place frees up when a queued job starts; on average that takes
+            # the drain time of one job's share of the backlog.
+            if rate and backlog:
+                return max(1, math.ceil(backlog / rate / queued)), None
+            return ADMISSION_RETRY_SECONDS, None
+        # Work already admitted drains at the measured rate; new jobs wait
+        # while it needs more than MAX_BACKLOG_SECONDS. The new job's own size
+        # is left out, or a big job would be refused while any work is queued.
+        if rate and backlog / rate > MAX_BACKLOG_SECONDS:
+            return max(1, math.ceil(backlog / rate - MAX_BACKLOG_SECONDS)), None
+        return None, round((backlog + cost) / rate, 1) if rate else None
+
+    def too_busy(self, retry_after: int) -> web.Response:
+        return web.json_response({'error': 'Too many requests queued', 'retry_after': retry_after},
+                                 status=429, headers={'Retry-After': str(retry_after)})
+
+    def cluster_hash_rate(self) -> float:
+        return sum(self.workers[url]['hash_rate'] for url in self.live_workers())
+
+    def rank(self, request_data: Dict[str, Any]) -> Tuple[int, int]:
+        # Priority classes first and shortest job first inside a class; every
+        # PRIORITY_AGING_SECONDS in the queue lifts a request one class, so a
+        # stream of small jobs cannot starve a big one.
+        waited = time.time() - request_data.get('submitted_at', time.time())
+        priority = request_data.get('priority', DEFAULT_PRIORITY) + int(waited // PRIORITY_AGING_SECONDS)
+        return -priority, request_data.get('cost', 0)
+
+    def build_schedule(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
+        rate = self.cluster_hash_rate()
+        remaining = max(request_data['candidates_total'] - request_data['candidates_done'], 0)
+        return {
+            'priority': request_data.get('priority', DEFAULT_PRIORITY),
+            'cost': request_data['candidates_total'],
+            'expected_seconds': round(remaining / rate, 1) if rate else None,
+            'queue_position': self.queue_positions.get(request_data['request_id'])
+        }
+
+    async def start_job(self, request_data: Dict[str, Any]) -> None:
+        targets = request_data['targets']
+        max_length = request_data['max_length']
+        request_ids = list(targets.values())
+        await self.request_store.set_status_many(request_ids, Status.IN_PROGRESS.value)
+
+        targets, min_length = await self.skip_searched_lengths(targets, max_length)
+        part_count = chunk_count(min_length, max_length) if targets else 0
+        if targets:
+            await self.request_store.set_part_count(list(targets.values()), part_count,
+                                                    candidate_count(min_length, max_length))
+        self.jobs[str(uuid.uuid4())] = {
+            'request_ids': request_ids,
+            'targets': targets,
+            'chunks': enumerate(generate_chunks(min_length, max_length)),
+            'part_count': part_count,
+            'retry': [],
+            'exhausted': not targets,
+            'priority': request_data.get('priority', DEFAULT_PRIORITY),
+            'in_flight': 0,
+            'dispatched_at': 0.0
+        }
+        self.work_ready.set()
+
+    def next_job(self) -> Optional[Dict[str, Any]]:
+        # Weighted fair share: the job with the fewest chunks on workers per
+        # priority class goes next, and among equals the one that waited
+        # longest, so a small job gets workers as soon as they free up instead
+        # of queueing behind a long one.
+        jobs = [job for job in self.jobs.values() if job['retry'] or not job['exhausted']]
+        if not jobs:
+            return None
+        return min(jobs, key=lambda job: (job['in_flight'] / (job['priority'] + 1), job['dispatched_at']))
+
+    def take_chunk(self, job: Dict[str, Any]) -> Optional[Tuple[int, Tuple[int, int, int]]]:
+        if job['retry']:
+            return job['retry'].pop()
+        try:
+            return next(job['chunks'])
+        except StopIteration:
+            job['exhausted'] = True
+            return None
+
+    async def worker_dispatcher(self, worker_url: str) -> None:
+        # Every worker pulls the next chunk as soon as it is free; a chunk the
+        # worker could not take is handed to the others and the worker drops out.
+        while worker_url in self.workers:
+            job = self.next_job()
+            if job is None:
+                self.work_ready.clear()
+                await self.work_ready.wait()
+                continue
+            chunk = self.take_chunk(job)
+            if chunk is None:
+                continue
+            if await self.requests_finished(list(job['targets'].values())):
+                job['retry'].clear()
+                job['exhausted'] = True
+                continue
+
+            part_number, (length, start, end) = chunk
+            task_data = {
+                'targets': job['targets'],
+                'length': length,
+                'start': start,
+                'end': end,
+                'part_number': part_number,
+                'part_count': job['part_count']
+            }
+            job['in_flight'] += 1
+            job['dispatched_at'] = time.monotonic()
             try:
-                request_data = self.request_queue.get_nowait()
-
-                request_id = request_data['request_id']
-                hash_target = request_data['hash']
-                max_length = request_data['max_length']
-                part_count = len(WORKER_URLS)
-
-                request_data = await self.request_store.get_request(request_id)
-                request_data["status"] = Status.IN_PROGRESS.value
-
-                for part_number in range(part_count):
-                    task_data = {
-                        'request_id': request_id,
-                        'hash': hash_target,
-                        'max_length': max_length,
-                        'part_number': part_number,
-                        'part_count': part_count
-                    }
-                    asyncio.create_task(
-                        self.safe_send_task(
-                            WORKER_URLS[part_number],
-                            task_data,
-                            request_id
-                        )
-                    )
-                while True:
-                    if request_data["status"] in [Status.READY.value, Status.ERROR.value]:
-                        self.request_queue.task_done()
-                        if len(self.request_store.requests) > 1000:
-                            self.request_store.requests.pop(0)
-                        break
-                    await asyncio.sleep(1)
-
-            except asyncio.QueueEmpty:
-                await asyncio.sleep(1)
+                sent = await self.safe_send_task(worker_url, task_data, list(job['targets'].values()))
+            finally:
+                job['in_flight'] -= 1
+            if not sent:
+                job['retry'].append(chunk)
+                self.work_ready.set()
+                self.drop_worker(worker_url)
+                return
 
-    async def handle_crack_hash(self, request: web.Request) -> web.Response:
-        for url in WORKER_URLS:
-            health_check = False
-            for _ in range(RETRY_COUNT + 1):
-                if await self.check_worker_health(url):
-                    health_check = True
-                    break
-                else:
-                    logging.error(f"Worker {url} unavailable. Retry...")
-                    await asyncio.sleep(RETRY_TIMEOUT_SECONDS)
-            if not health_check:
-                return web.json_response({'error': 'One or more workers are down'}, status=500)
+    async def requests_finished(self, request_ids: List[str]) -> bool:
+        for request_id in request_ids:
+            request_data = await self.request_store.get_request(request_id)
+            if request_data['status'] not in [Status.READY.value, Status.ERROR.value]:
+                return False
+        return True
 
+    async def broadcast_cancel(self, request_ids: List[str]) -> None:
+        async def cancel(worker_url: str) -> None:
+            try:
+                async with self.session.post(f"{worker_url}{WORKER_CANCEL_URL}",
+                                             json={'request_ids': request_ids}) as response:
+                    if response.status != 200:
+                        logging.error(f"Worker {worker_url} rejected cancel of {request_ids}")
+            except Exception as e:
+                logging.error(f"Cancel {request_ids} failed for {worker_url}: {str(e)}")
+
+        await asyncio.gather(*(cancel(url) for url in self.live_workers()))
+
+    async def skip_searched_lengths(self, targets: Dict[str, str], max_length: int) -> Tuple[Dict[str, str], int]:
+        searched = await self.request_store.get_searched(list(targets))
+        stop_on_first_match = {request_id for request_id, request_data in
+                               (await self.request_store.get_requests(list(targets.values()))).items()
+                               if request_data['stop_on_first_match']}
+        finished = []
+        stopped = []
+        remaining: Dict[str, str] = {}
+        min_length = max_length
+        for hash_target, request_id in targets.items():
+            searched_length = 0
+            results = []
+            if hash_target in searched:
+                searched_length = searched[hash_target]['max_length']
+                results = [result for result in searched[hash_target]['results'] if len(result) <= max_length]
+                await self.request_store.add_results(request_id, results)
+            if searched_length >= max_length:
+                finished.append(request_id)
+            elif results and request_id in stop_on_first_match:
+                # A stored hit is already the first match.
+                stopped.append(request_id)
+            else:
+                remaining[hash_target] = request_id
+                min_length = min(min_length, searched_length + 1)
+        await self.request_store.finish_requests(finished)
+        await self.request_store.finish_requests(stopped, exhausted=False)
+        return remaining, min_length
+
+    async def check_workers(self) -> bool:
+        return bool(self.live_workers())
+
+    def normalize_hash(self, hash_target: Any) -> Optional[str]:
+        # Workers turn targets into digests with bytes.fromhex, so one bad
+        # hash would fail its whole batch, and hashes differing only in case
+        # would share a digest; both are settled here, before any lookup.
+        if not isinstance(hash_target, str) or len(hash_target) != MD5_HEX_LENGTH:
+            return None
+        if any(char not in string.hexdigits for char in hash_target):
+            return None
+        return hash_target.lower()
+
+    async def handle_crack_hash(self, request: web.Request) -> web.Response:
         data = await request.json()
         hash_target = data.get('hash')
         max_length = data.get('maxLength')
+        stop_on_first_match = bool(data.get('stopOnFirstMatch', False))
+        priority = data.get('priority', DEFAULT_PRIORITY)
 
         if not hash_target or not max_length:
             return web.json_response({'error': 'Missing hash or maxLength'}, status=400)
+        if not isinstance(max_length, int) or isinstance(max_length, bool) or not 1 <= max_length <= MAX_LENGTH:
+            return web.json_response({'error': f'maxLength must be an integer from 1 to {MAX_LENGTH}'}, status=400)
+        hash_target = self.normalize_hash(hash_target)
+        if not hash_target:
+            return web.json_response({'error': f'hash must be {MD5_HEX_LENGTH} hex characters'}, status=400)
+        if not isinstance(priority, int) or isinstance(priority, bool) or not 0 <= priority <= MAX_PRIORITY:
+            return web.json_response({'error': f'priority must be an integer from 0 to {MAX_PRIORITY}'}, status=400)
+
+        request_id = await self.request_store.find_known_request(hash_target, max_length)
+        if request_id:
+            request_data = await self.request_store.get_request(request_id)
+            return web.json_response({'RequestId': request_id, 'status': request_data['status']})
+
+        if not await self.check_workers():
+            return web.json_response({'error': 'No workers available'}, status=500)
+
+        retry_after, eta_seconds = await self.admit(candidate_count(1, max_length))
+        if retry_after is not None:
+            return self.too_busy(retry_after)
 
         request_id = str(uuid.uuid4())
-        part_count = len(WORKER_URLS)
-        await self.request_store.create_request(request_id, part_count)
-        await self.request_queue.put({
-            'request_id': request_id,
-            'hash': hash_target,
-            'max_length': max_length
+        part_count = chunk_count(1, max_length)
+        known_id = await self.request_store.create_request(request_id, part_count, hash_target, max_length,
+                                                           stop_on_first_match, priority)
+        if known_id:
+            request_data = await self.request_store.get_request(known_id)
+            return web.json_response({'RequestId': known_id, 'status': request_data['status']})
+        self.pending.append({
+            'targets': {hash_target: request_id},
+            'max_length': max_length,
+            'priority': priority,
+            'cost': candidate_count(1, max_length),
+            'submitted_at': time.time()
         })
         print(f"put {request_id}")
-        return web.json_response({'RequestId': request_id})
+        return web.json_response({'RequestId': request_id, 'status': Status.NEW.value, 'eta_seconds': eta_seconds})
 
-    async def safe_send_task(self, worker_url: str, task_data: Dict[str, Any], request_id: str) -> None:
+    async def handle_crack_batch(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        hashes = data.get('hashes')
+        max_length = data.get('maxLength')
+        stop_on_first_match = bool(data.get('stopOnFirstMatch', False))
+        priority = data.get('priority', DEFAULT_PRIORITY)
+
+        if not hashes or not isinstance(hashes, list) or not max_length:
+            return web.json_response({'error': 'Missing hashes or maxLength'}, status=400)
+        if not isinstance(max_length, int) or isinstance(max_length, bool) or not 1 <= max_length <= MAX_LENGTH:
+            return web.json_response({'error': f'maxLength must be an integer from 1 to {MAX_LENGTH}'}, status=400)
+        if len(hashes) > MAX_BATCH_SIZE:
+            return web.json_response({'error': f'Batch is larger than {MAX_BATCH_SIZE} hashes'}, status=400)
+        hashes = [self.normalize_hash(hash_target) for hash_target in hashes]
+        if not all(hashes):
+            return web.json_response({'error': f'Every hash must be {MD5_HEX_LENGTH} hex characters'}, status=400)
+        if not isinstance(priority, int) or isinstance(priority, bool) or not 0 <= priority <= MAX_PRIORITY:
+            return web.json_response({'error': f'priority must be an integer from 0 to {MAX_PRIORITY}'}, status=400)
+
+        request_ids: Dict[str, str] = {}
+        new_hashes = []
+        for hash_target in hashes:
+            if hash_target in request_ids:
+                continue
+            request_id = await self.request_store.find_known_request(hash_target, max_length)
+            if request_id:
+                request_ids[hash_target] = request_id
+            else:
+                request_ids[hash_target] = str(uuid.uuid4())
+                new_hashes.append(hash_target)
+
+        eta_seconds = None
+        targets: Dict[str, str] = {}
+        if new_hashes:
+            if not await self.check_workers():
+                return web.json_response({'error': 'No workers available'}, status=500)
+            retry_after, eta_seconds = await self.admit(candidate_count(1, max_length))
+            if retry_after is not None:
+                return self.too_busy(retry_after)
+
+            part_count = chunk_count(1, max_length)
+            for hash_target in new_hashes:
+                known_id = await self.request_store.create_request(request_ids[hash_target], part_count, hash_target,
+                                                                   max_length, stop_on_first_match, priority)
+                if known_id:
+                    request_ids[hash_target] = known_id
+                else:
+                    targets[hash_target] = request_ids[hash_target]
+        if targets:
+            self.pending.append({
+                'targets': targets,
+                'max_length': max_length,
+                'priority': priority,
+                'cost': candidate_count(1, max_length),
+                'submitted_at': time.time()
+            })
+        return web.json_response({'RequestIds': [request_ids[hash_target] for hash_target in hashes],
+                                  'eta_seconds': eta_seconds})
+
+    async def safe_send_task(self, worker_url: str, task_data: Dict[str, Any], request_ids: List[str]) -> bool:
+        request_id = ", ".join(request_ids)
         for _ in range(RETRY_COUNT + 1):
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        f"{worker_url}{WORKER_TASK_URL}",
-                        json=task_data
-                    ) as response:
-                        if response.status != 200:
-                            logging.error(f"Worker {worker_url} failed for request {request_id}")
-                        else:
-                            return
+                async with self.session.post(
+                    f"{worker_url}{WORKER_TASK_URL}",
+                    json=task_data
+                ) as response:
+                    if response.status != 200:
+                        logging.error(f"Worker {worker_url} failed for request {request_id}")
+                    else:
+                        return True
             except Exception as e:
                 logging.error(f"Task {request_id} failed for {worker_url}: {str(e)} \n Retry...")
                 await asyncio.sleep(RETRY_TIMEOUT_SECONDS)
         logging.error(f"Task {request_id} failed for {worker_url} \n Maximum number of retry attempts reached")
-        await self.request_store.mark_worker_failed(request_id)
-
-    async def handle_get_status(self, request: web.Request) -> web.Response:
-        request_id = request.query.get('requestId')
-        if not request_id:
-            return web.json_response({'error': 'Missing requestId'}, status=400)
-
-        request_data = await self.request_store.get_request(request_id)
-        if not request_data:
-            return web.json_response({'error': 'Invalid requestId'}, status=404)
-
-        await self.request_store.check_timeouts()
-
-        request_data = await self.request_store.get_request(request_id)
-
-        part_count = len(WORKER_URLS)
+        return False
 
+    def format_progress(self, request_data: Dict[str, Any]) -> str:
+        # Workers push candidate counts, so progress moves inside long chunks
+        # too; redelivered chunks may overcount, hence the cap below 100%.
         total_percentage = 0
         if request_data['status'] == Status.IN_PROGRESS.value:
-            for part_number in range(part_count):
-                percent = await self.get_progress(request_id, WORKER_URLS[part_number])
-                if percent:
-                    total_percentage += float(percent)
-                else:
-                    total_percentage = 0
-                    break
-            total_percentage = total_percentage / 3 * 100
+            if request_data['candidates_total']:
+                share = request_data['candidates_done'] / request_data['candidates_total']
+            else:
+                share = request_data['parts_received'] / request_data['part_count'] if request_data['part_count'] else 0
+            total_percentage = min(share * 100, 99)
         elif request_data['status'] == Status.NEW.value:
             total_percentage = 0
         elif request_data['status'] == Status.READY.value:
             total_percentage = 100
+        return f"{total_percentage:.0f}%"
 
+    def build_status(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
         status = request_data['status']
-        part_count = request_data['part_count']
-        parts_received = request_data['parts_received']
-        progress_str = f"{total_percentage:.0f}%"
-        results = request_data['results']
+        progress_str = self.format_progress(request_data)
+        results = list(request_data['results'])
 
         response_data = {
             'status': status,
@@ -214,52 +643,161 @@ class Manager:
         if status == Status.READY.value:
             response_data['data'] = results
             del response_data['partial_result']
+        elif status in [Status.NEW.value, Status.IN_PROGRESS.value]:
+            response_data['schedule'] = self.build_schedule(request_data)
+
+        return response_data
+
+    def cache_status(self, request_id: str, response_data: Dict[str, Any]) -> None:
+        current_time = time.time()
+        if len(self.status_cache) >= STATUS_CACHE_SIZE:
+            self.status_cache = {key: value for key, value in self.status_cache.items() if value[0] > current_time}
+        self.status_cache[request_id] = (current_time + STATUS_CACHE_SECONDS, response_data)
+
+    async def handle_get_status(self, request: web.Request) -> web.Response:
+        request_id = request.query.get('requestId')
+        if not request_id:
+            return web.json_response({'error': 'Missing requestId'}, status=400)
+
+        snapshot = self.status_cache.get(request_id)
+        if snapshot and snapshot[0] > time.time():
+            return web.json_response(snapshot[1])
+        request_data = await self.request_store.get_request(request_id)
+        if not request_data:
+            return web.json_response({'error': 'Invalid requestId'}, status=404)
 
+        response_data = self.build_status(request_data)
+        self.cache_status(request_id, response_data)
         return web.json_response(response_data)
 
-    async def get_progress(self, request_id: str, worker_url: str) -> Optional[str]:
-        for _ in range(RETRY_COUNT + 1):
+    async def handle_get_status_batch(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        request_ids = data.get('requestIds')
+        changed_since = data.get('changedSince', 0)
+
+        if not isinstance(request_ids, list) or not request_ids:
+            return web.json_response({'error': 'Missing requestIds'}, status=400)
+        if len(request_ids) > MAX_STATUS_BATCH_SIZE:
+            return web.json_response({'error': f'Too many requestIds, max {MAX_STATUS_BATCH_SIZE}'}, status=400)
+        if not isinstance(changed_since, (int, float)):
+            return web.json_response({'error': 'changedSince must be a timestamp'}, status=400)
+
+        # Taken before the read, so a change racing with it shows up again on
+        # the next poll instead of being lost.
+        timestamp = time.time()
+        statuses = {
+            request_id: {'status': request_data['status'], 'progress': self.format_progress(request_data)}
+            for request_id, request_data in (await self.request_store.get_requests(request_ids, changed_since)).items()
+        }
+        return web.json_response({'statuses': statuses, 'timestamp': timestamp})
+
+    async def status_broadcaster(self) -> None:
+        # One store read per tick for all subscribed requests, fanned out to
+        # every open stream, so watchers do not multiply the load.
+        while True:
+            await asyncio.sleep(STATUS_STREAM_SECONDS)
+            if not self.subscribers:
+                continue
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(
-                        f"{worker_url}{WORKER_PROGRESS_URL}"
-                    ) as response:
-                        if response.status != 200:
-                            logging.error(f"Worker {worker_url} failed for request")
-                        else:
-                            return await response.text()
+                for request_id in list(self.subscribers):
+                    request_data = await self.request_store.get_request(request_id)
+                    if not request_data:
+                        continue
+                    status_data = self.build_status(request_data)
+                    self.cache_status(request_id, status_data)
+                    if self.streamed.get(request_id) == status_data:
+                        continue
+                    self.streamed[request_id] = status_data
+                    for queue in self.subscribers.get(request_id, set()):
+                        queue.put_nowait(status_data)
             except Exception as e:
-                logging.error(f"Get progress {request_id} failed for {worker_url}: {str(e)} \n Retry...")
-                await asyncio.sleep(RETRY_TIMEOUT_SECONDS)
-        logging.error(f"Get progress {request_id} failed for {worker_url} \n Maximum number of retry attempts reached")
-        await self.request_store.mark_worker_failed(request_id)
-        return None
+                logging.error(f"Exception status_broadcaster {e}")
+
+    async def send_event(self, response: web.StreamResponse, status_data: Dict[str, Any]) -> None:
+        await response.write(f"data: {json.dumps(status_data)}\n\n".encode())
+
+    async def handle_status_stream(self, request: web.Request) -> web.StreamResponse:
+        request_id = request.query.get('requestId')
+        if not request_id:
+            return web.json_response({'error': 'Missing requestId'}, status=400)
+
+        request_data = await self.request_store.get_request(request_id)
+        if not request_data:
+            return web.json_response({'error': 'Invalid requestId'}, status=404)
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(request_id, set()).add(queue)
+        try:
+            status_data = self.build_status(request_data)
+            await self.send_event(response, status_data)
+            while status_data['status'] not in [Status.READY.value, Status.ERROR.value]:
+                try:
+                    status_data = await asyncio.wait_for(queue.get(), timeout=STATUS_STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    await response.write(b": keepalive\n\n")
+                    continue
+                await self.send_event(response, status_data)
+        except ConnectionResetError:
+            pass
+        finally:
+            subscribers = self.subscribers.get(request_id)
+            subscribers.discard(queue)
+            if not subscribers:
+                del self.subscribers[request_id]
+                self.streamed.pop(request_id, None)
+        return response
 
     async def handle_patch_request(self, request: web.Request) -> web.Response:
         try:
-            data = await request.text()
-            root = ET.fromstring(data)
-            request_id = root.findtext('RequestId')
-            part_number = int(root.findtext('PartNumber'))
-            part_count = int(root.findtext('PartCount'))
-            results = [elem.text for elem in root.findall('Results/Result')]
-            partial = root.findtext('Partial')
-            await self.request_store.update_request(request_id, results, partial)
+            results, _ = load_results(await request.read(), request.content_type)
+            stopped = []
+            for request_id, part_number, part_count, words, partial in results:
+                if await self.request_store.update_request(request_id, part_number, words, partial):
+                    logging.info(f"Request {request_id} found a match, cancelling its chunks")
+                    stopped.append(request_id)
+            if stopped:
+                asyncio.create_task(self.broadcast_cancel(stopped))
             return web.Response(status=200)
         except Exception as e:
             return web.Response(status=400)
 
+    async def handle_progress(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        progress = data.get('progress')
+        if not isinstance(progress, list):
+            return web.Response(status=400)
+        for entry in progress:
+            await self.request_store.add_progress(entry.get('request_ids', []), entry.get('count', 0))
+        return web.Response(status=200)
+
     async def background_timeout_checker(self, app: web.Application) -> None:
         while True:
             await asyncio.sleep(10)
             await self.request_store.check_timeouts()
 
     async def start_background_tasks(self, app: web.Application) -> None:
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(total=None)
+        )
+        self.work_ready = asyncio.Event()
+        app['health_monitor'] = asyncio.create_task(self.health_monitor())
         app['process_requests'] = asyncio.create_task(self.process_requests())
         app['background_timeout_checker'] = asyncio.create_task(self.background_timeout_checker(app))
+        app['status_broadcaster'] = asyncio.create_task(self.status_broadcaster())
 
     async def cleanup_background_tasks(self, app: web.Application) -> None:
         app['process_requests'].cancel()
+        for dispatcher in self.dispatchers.values():
+            dispatcher.cancel()
         await app['process_requests']
         app['background_timeout_checker'].cancel()
         await app['background_timeout_checker']
+        app['status_broadcaster'].cancel()
+        await app['status_broadcaster']
+        app['health_monitor'].cancel()
+        await app['health_monitor']
+        await self.session.close()
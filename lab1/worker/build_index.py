@@ -0,0 +1,39 @@
+import os
+import sys
+import time
+from config import *
+from digest_index import RECORD_SIZE, index_path
+from md5_numpy import np, md5_range
+
+BUILD_BLOCK_SIZE = 36 ** 4
+
+
+def build_length(length: int) -> None:
+    count = 36 ** length
+    prefixes = np.empty(count, dtype=np.uint64)
+    for block_start in range(0, count, BUILD_BLOCK_SIZE):
+        block_end = min(block_start + BUILD_BLOCK_SIZE, count)
+        digests = md5_range(length, block_start, block_end).astype('<u4')
+        prefixes[block_start:block_end] = digests.view(np.uint8)[:, :8].copy().view('>u8').ravel()
+
+    order = np.argsort(prefixes, kind='stable')
+    records = np.empty(count, dtype=np.dtype([
+        ('prefix', np.uint8, INDEX_PREFIX_BYTES),
+        ('num', '<u4')
+    ]))
+    assert records.itemsize == RECORD_SIZE
+    records['prefix'] = prefixes[order].astype('>u8').view(np.uint8).reshape(count, 8)[:, :INDEX_PREFIX_BYTES]
+    records['num'] = order
+
+    path = index_path(length)
+    records.tofile(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+if __name__ == '__main__':
+    max_length = int(sys.argv[1]) if len(sys.argv) > 1 else INDEX_MAX_LENGTH
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    for length in range(1, max_length + 1):
+        begin = time.perf_counter()
+        build_length(length)
+        print(f"length {length}: {36 ** length} records in {time.perf_counter() - begin:.1f}s -> {index_path(length)}")
@@ -1,8 +1,31 @@
+import os
+import socket
+
 WORKER_PORT = 8080
+WORKER_URL = os.environ.get('WORKER_URL', f'http://{socket.gethostname()}:{WORKER_PORT}')
 MANAGER_URL = 'http://manager:8080'
 ALPHABET = 'abcdefghijklmnopqrstuvwxyz0123456789'
 
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', os.cpu_count() or 1))
+SUBRANGES_PER_PROCESS = 4
+PROGRESS_STEP = 10000
+PROGRESS_POLL_SECONDS = 0.5
+WORKER_ENGINE = os.environ.get('WORKER_ENGINE', 'hashlib')
+NUMPY_BLOCK_SIZE = 36 ** 3
+INDEX_DIR = os.environ.get('INDEX_DIR', 'index')
+INDEX_MAX_LENGTH = 5
+INDEX_PREFIX_BYTES = 8
+CANCELLED_HISTORY = 10000
+PROGRESS_PUSH_SECONDS = 1
+HEARTBEAT_SECONDS = 3
+MANAGER_TIMEOUT_SECONDS = 5
+# msgpack, or xml for managers that only read CrackResult documents
+MESSAGE_FORMAT = os.environ.get('MESSAGE_FORMAT', 'msgpack')
+
 WORKER_TASK_URL = "/internal/api/worker/hash/crack/task"
 WORKER_HEALTH_URL = "/health"
 WORKER_PROGRESS_URL = "/progress"
-MANAGER_PATCH_URL = "/internal/api/manager/hash/crack/request"
\ No newline at end of file
+WORKER_CANCEL_URL = "/internal/api/worker/hash/crack/cancel"
+MANAGER_PATCH_URL = "/internal/api/manager/hash/crack/request"
+MANAGER_HEARTBEAT_URL = "/internal/api/manager/workers/heartbeat"
+MANAGER_PROGRESS_URL = "/internal/api/manager/hash/crack/progress"
\ No newline at end of file
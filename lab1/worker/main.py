@@ -7,4 +7,8 @@ if __name__ == '__main__':
     app.router.add_post(WORKER_TASK_URL, worker.handle_worker_task)
     app.router.add_get(WORKER_HEALTH_URL, worker.health_check)
     app.router.add_get(WORKER_PROGRESS_URL, worker.handle_progress)
+    app.router.add_post(WORKER_CANCEL_URL, worker.handle_cancel)
+
+    app.on_startup.append(worker.start_background_tasks)
+    app.on_cleanup.append(worker.cleanup_background_tasks)
     web.run_app(app, port=WORKER_PORT)
\ No newline at end of file
@@ -0,0 +1,128 @@
+import json
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List, Tuple
+
+import msgpack
+
+# The format version is part of the content type, so a consumer can tell an
+# old XML or JSON message from a compact one without looking at the body.
+JSON_CONTENT_TYPE = 'application/json'
+XML_CONTENT_TYPES = ('application/xml', 'text/xml', 'text/plain')
+MSGPACK_CONTENT_TYPE = 'application/vnd.crackhash.v1+msgpack'
+
+# (request_id, part_number, part_count, results, partial)
+ResultRecord = Tuple[str, int, int, List[str], bool]
+# (request_ids, part_number, length, offset)
+CheckpointRecord = Tuple[List[str], int, int, int]
+
+
+def content_type_for(message_format: str) -> str:
+    if message_format == 'msgpack':
+        return MSGPACK_CONTENT_TYPE
+    if message_format == 'json':
+        return JSON_CONTENT_TYPE
+    raise ValueError(f"Unknown message format {message_format}")
+
+
+def dump_message(message: Dict[str, Any], content_type: str) -> bytes:
+    if content_type == MSGPACK_CONTENT_TYPE:
+        return msgpack.packb(message, use_bin_type=True)
+    if content_type == JSON_CONTENT_TYPE:
+        return json.dumps(message).encode()
+    raise ValueError(f"Unsupported content type {content_type}")
+
+
+def load_message(body: bytes, content_type: str) -> Dict[str, Any]:
+    if content_type == MSGPACK_CONTENT_TYPE:
+        message = msgpack.unpackb(body, raw=False)
+    elif content_type == JSON_CONTENT_TYPE:
+        message = json.loads(body.decode())
+    else:
+        raise ValueError(f"Unsupported content type {content_type}")
+    if not isinstance(message, dict):
+        raise ValueError("Message is not a dictionary")
+    return message
+
+
+def dump_results(results: List[ResultRecord], checkpoints: List[CheckpointRecord]) -> bytes:
+    """Pack any number of results and checkpoints into one message."""
+    return msgpack.packb({'r': results, 'c': checkpoints}, use_bin_type=True)
+
+
+def result_to_xml(result: ResultRecord) -> str:
+    request_id, part_number, part_count, results, partial = result
+    root = ET.Element('CrackResult')
+    ET.SubElement(root, 'RequestId').text = request_id
+    ET.SubElement(root, 'PartNumber').text = str(part_number)
+    ET.SubElement(root, 'PartCount').text = str(part_count)
+
+    results_elem = ET.SubElement(root, 'Results')
+    for res in results:
+        ET.SubElement(results_elem, 'Result').text = res
+
+    ET.SubElement(root, 'Partial').text = str(bool(partial))
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding='unicode')
+
+
+def checkpoint_to_xml(checkpoint: CheckpointRecord) -> str:
+    request_ids, part_number, length, offset = checkpoint
+    root = ET.Element('CrackCheckpoint')
+    request_ids_elem = ET.SubElement(root, 'RequestIds')
+    for request_id in request_ids:
+        ET.SubElement(request_ids_elem, 'RequestId').text = request_id
+    ET.SubElement(root, 'PartNumber').text = str(part_number)
+    ET.SubElement(root, 'Length').text = str(length)
+    ET.SubElement(root, 'Offset').text = str(offset)
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding='unicode')
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _is_strings(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def check_result(result: Any) -> ResultRecord:
+    if not (isinstance(result, (list, tuple)) and len(result) == 5 and isinstance(result[0], str)
+            and _is_int(result[1]) and _is_int(result[2]) and _is_strings(result[3])
+            and isinstance(result[4], bool)):
+        raise ValueError(f"Malformed result {result!r}")
+    return tuple(result)
+
+
+def check_checkpoint(checkpoint: Any) -> CheckpointRecord:
+    if not (isinstance(checkpoint, (list, tuple)) and len(checkpoint) == 4 and _is_strings(checkpoint[0])
+            and all(_is_int(value) for value in checkpoint[1:])):
+        raise ValueError(f"Malformed checkpoint {checkpoint!r}")
+    return tuple(checkpoint)
+
+
+def load_results(body: bytes, content_type: str) -> Tuple[List[ResultRecord], List[CheckpointRecord]]:
+    """Unpack a result message in either format into results and checkpoints.
+
+    Raises ValueError for a message or record of the wrong shape, which no
+    retry can fix.
+    """
+    if content_type == MSGPACK_CONTENT_TYPE:
+        message = msgpack.unpackb(body, raw=False)
+        if not isinstance(message, dict):
+            raise ValueError("Message is not a dictionary")
+        return ([check_result(result) for result in message.get('r', [])],
+                [check_checkpoint(checkpoint) for checkpoint in message.get('c', [])])
+    if content_type not in XML_CONTENT_TYPES:
+        raise ValueError(f"Unsupported content type {content_type}")
+
+    root = ET.fromstring(body)
+    if root.tag == 'CrackCheckpoint':
+        request_ids = [elem.text for elem in root.findall('RequestIds/RequestId')]
+        return [], [check_checkpoint((request_ids, int(root.findtext('PartNumber')), int(root.findtext('Length')),
+                                      int(root.findtext('Offset'))))]
+    return [check_result((
+        root.findtext('RequestId'),
+        int(root.findtext('PartNumber')),
+        int(root.findtext('PartCount')),
+        [elem.text for elem in root.findall('Results/Result')],
+        root.findtext('Partial') != 'False'
+    ))], []
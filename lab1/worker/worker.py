@@ -1,99 +1,291 @@
+import aiohttp
 from aiohttp import web
 import hashlib
-import xml.etree.ElementTree as ET
 import asyncio
+import time
+import multiprocessing
 import requests
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
 from config import *
+from protocol import MSGPACK_CONTENT_TYPE, dump_results, result_to_xml
+from search import init_process, num_to_word, split_range, search_range
+from md5_numpy import search_range_numpy, verify_numpy_engine
+from digest_index import DigestIndex
 
 class WorkerHelper:
     def __init__(self):
         self.current_tasks: int = 0
         self.total_tasks: int = 0
+        self.results: Dict[Tuple[str, int], list] = {}
+        self.search = search_range
+        self.step = PROGRESS_STEP
+        if WORKER_ENGINE == 'numpy':
+            if verify_numpy_engine():
+                self.search = search_range_numpy
+                self.step = NUMPY_BLOCK_SIZE
+            else:
+                print("NumPy engine is unavailable or failed verification, using hashlib engine")
+        self.digest_index = DigestIndex()
+        self.digest_index.open()
+        self.cancelled: OrderedDict = OrderedDict()
+        self.current_request_ids: Set[str] = set()
+        self.reported_tasks: int = 0
+        self.checked_total: int = 0
+        self.rate_checked: int = 0
+        self.rate_time: float = time.time()
+        self.hash_rate: float = 0
+        self.progress_deltas: Dict[Tuple[str, ...], int] = {}
+        self.pool = None
+        self.progress = None
+        self.cancel_flag = None
+        if WORKER_PROCESSES > 1:
+            context = multiprocessing.get_context('spawn')
+            self.progress = context.Value('q', 0)
+            self.cancel_flag = context.Value('b', 0)
+            self.pool = ProcessPoolExecutor(
+                max_workers=WORKER_PROCESSES,
+                mp_context=context,
+                initializer=init_process,
+                initargs=(self.progress, self.cancel_flag)
+            )
 
     def num_to_word(self, num: int, length: int) -> str:
-        chars = ""
-        for _ in range(length):
-            num, rem = divmod(num, 36)
-            chars += ALPHABET[rem]
-        return chars
-
-    async def process_task(self, request_id: str, hash_target: str, max_length: int, part_number: int, part_count: int) -> List[str]:
-        results: List[str] = []
+        return num_to_word(num, length)
+
+    def cancel(self, request_ids: List[str]) -> None:
+        for request_id in request_ids:
+            self.cancelled[request_id] = True
+            self.cancelled.move_to_end(request_id)
+        while len(self.cancelled) > CANCELLED_HISTORY:
+            self.cancelled.popitem(last=False)
+        if self.pool and self.is_cancelled(self.current_request_ids):
+            self.cancel_flag.value = 1
+
+    def is_cancelled(self, request_ids) -> bool:
+        request_ids = set(request_ids)
+        return bool(request_ids) and all(request_id in self.cancelled for request_id in request_ids)
+
+    async def process_task(self, targets: Dict[str, str], length: int, start: int, end: int, part_number: int,
+                           part_count: int) -> bool:
+        digests = {bytes.fromhex(hash_target): request_id for hash_target, request_id in targets.items()}
+        target_set = frozenset(digests)
+        self.flush_progress()
+        self.current_request_ids = set(targets.values())
         self.current_tasks = 0
-        self.total_tasks = 0
-        for length in range(1, max_length + 1):
-            self.total_tasks += 36 ** length
-        self.total_tasks /= part_count
-
-        for length in range(1, max_length + 1):
-            total = 36 ** length
-            per_part, rem = divmod(total, part_count)
-            if part_number < rem:
-                start = part_number * (per_part + 1)
-                end = start + (per_part + 1)
-            else:
-                start = rem * (per_part + 1) + (part_number - rem) * per_part
-                end = start + per_part
-
-            for word_num in range(start, end):
-                word = self.num_to_word(word_num, length)
-                md5 = hashlib.md5(word.encode()).hexdigest()
-                if md5 == hash_target:
-                    self.send_response(request_id, part_number, part_count, [word], partial=True)
-                self.current_tasks += 1
-                if self.current_tasks % 10000 == 0:
-                    await asyncio.sleep(0)
-        return results
-
-    def send_response(self, request_id: str, part_number: int, part_count: int, results: List[str], partial: bool = False) -> None:
-        root = ET.Element('CrackResult')
-        ET.SubElement(root, 'RequestId').text = request_id
-        ET.SubElement(root, 'PartNumber').text = str(part_number)
-        ET.SubElement(root, 'PartCount').text = str(part_count)
-
-        results_elem = ET.SubElement(root, 'Results')
-        for res in results:
-            ET.SubElement(results_elem, 'Result').text = res
-
-        if partial:
-            ET.SubElement(root, 'Partial').text = "True"
+        self.reported_tasks = 0
+        self.total_tasks = end - start
+        if self.pool:
+            with self.progress.get_lock():
+                self.progress.value = 0
+            self.cancel_flag.value = 0
+
+        if self.digest_index.has_length(length):
+            for digest in digests:
+                for num in self.digest_index.lookup(digest, length):
+                    if start <= num < end:
+                        self.add_match(digests, num_to_word(num, length), part_number, part_count)
+            self.add_progress(end - start)
+            return True
+
+        if self.pool:
+            await self.process_range_pool(digests, target_set, length, start, end, part_number, part_count)
+            return not self.is_cancelled(self.current_request_ids)
+
+        for sub_start in range(start, end, self.step):
+            sub_end = min(sub_start + self.step, end)
+            for word in self.search(target_set, length, sub_start, sub_end):
+                self.add_match(digests, word, part_number, part_count)
+            self.current_tasks += sub_end - sub_start
+            if sub_end < end:
+                self.flush_results()
+            await asyncio.sleep(0)
+            if self.is_cancelled(self.current_request_ids):
+                return False
+        return True
+
+    def add_progress(self, count: int) -> None:
+        if self.pool:
+            with self.progress.get_lock():
+                self.progress.value += count
+            self.current_tasks = self.progress.value
         else:
-            ET.SubElement(root, 'Partial').text = "False"
+            self.current_tasks += count
 
-        xml_data = '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding='unicode')
+    def flush_progress(self) -> None:
+        count = self.current_tasks - self.reported_tasks
+        if count > 0:
+            key = tuple(sorted(self.current_request_ids))
+            self.progress_deltas[key] = self.progress_deltas.get(key, 0) + count
+            self.checked_total += count
+        self.reported_tasks = self.current_tasks
 
-        try:
-            response = requests.patch(
-                f"{MANAGER_URL}{MANAGER_PATCH_URL}",
-                data=xml_data,
-                headers={'Content-Type': 'application/xml'}
-            )
-            if response.status_code != 200:
-                print(f"Error: Received status code {response.status_code}")  # Log error
-        except Exception as e:
-            print(f"Exception occurred: {e}")  # Log exception
+    def take_progress(self) -> List[Dict[str, Any]]:
+        self.flush_progress()
+        progress = [{'request_ids': list(request_ids), 'count': count}
+                    for request_ids, count in self.progress_deltas.items()]
+        self.progress_deltas = {}
+        return progress
+
+    def measure_hash_rate(self) -> float:
+        # Keeps the last measured rate while idle, so the manager still sees
+        # what the worker is capable of.
+        self.flush_progress()
+        current_time = time.time()
+        checked = self.checked_total - self.rate_checked
+        if checked > 0:
+            self.hash_rate = checked / (current_time - self.rate_time)
+        self.rate_checked = self.checked_total
+        self.rate_time = current_time
+        return self.hash_rate
+
+    async def process_range_pool(self, digests: Dict[bytes, str], target_set: FrozenSet[bytes], length: int,
+                                 start: int, end: int, part_number: int, part_count: int) -> None:
+        loop = asyncio.get_running_loop()
+        pending = {
+            loop.run_in_executor(self.pool, self.search, target_set, length, sub_start, sub_end)
+            for sub_start, sub_end in split_range(start, end, WORKER_PROCESSES * SUBRANGES_PER_PROCESS)
+        }
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=PROGRESS_POLL_SECONDS)
+            self.current_tasks = self.progress.value
+            if self.cancel_flag.value:
+                for future in pending:
+                    future.cancel()
+            for future in done:
+                if future.cancelled():
+                    continue
+                for word in future.result():
+                    self.add_match(digests, word, part_number, part_count)
+            # Hits from the last subranges travel with the completion.
+            if pending:
+                self.flush_results()
+
+    def add_result(self, request_id: str, part_number: int, part_count: int, results: List[str],
+                   partial: bool = False) -> None:
+        # Hits and the completion of the same part merge into one record
+        # until the next flush_results().
+        key = (request_id, part_number)
+        if key in self.results:
+            record = self.results[key]
+            record[3].extend(results)
+            record[4] = record[4] and partial
+        else:
+            self.results[key] = [request_id, part_number, part_count, list(results), partial]
+
+    def add_match(self, digests: Dict[bytes, str], word: str, part_number: int, part_count: int) -> None:
+        request_id = digests[hashlib.md5(word.encode()).digest()]
+        self.add_result(request_id, part_number, part_count, [word], partial=True)
+
+    def flush_results(self) -> None:
+        results = [tuple(record) for record in self.results.values()]
+        if not results:
+            return
+        self.results = {}
+
+        if MESSAGE_FORMAT == 'msgpack':
+            messages = [(dump_results(results, []), MSGPACK_CONTENT_TYPE)]
+        else:
+            messages = [(result_to_xml(result), 'application/xml') for result in results]
+        for data, content_type in messages:
+            try:
+                response = requests.patch(
+                    f"{MANAGER_URL}{MANAGER_PATCH_URL}",
+                    data=data,
+                    headers={'Content-Type': content_type}
+                )
+                if response.status_code != 200:
+                    print(f"Error: Received status code {response.status_code}")  # Log error
+            except Exception as e:
+                print(f"Exception occurred: {e}")  # Log exception
 
 class Worker:
     def __init__(self):
         self.worker_helper = WorkerHelper()
+        self.session: Optional[aiohttp.ClientSession] = None
 
     async def handle_worker_task(self, request: web.Request) -> web.Response:
         data = await request.json()
-        request_id = data.get('request_id')
-        hash_target = data.get('hash')
-        max_length = data.get('max_length')
+        targets = data.get('targets')
+        length = data.get('length')
+        start = data.get('start')
+        end = data.get('end')
         part_number = data.get('part_number')
         part_count = data.get('part_count')
 
-        if not all([request_id, hash_target, max_length is not None, part_number is not None, part_count is not None]):
+        if not all([targets, length, start is not None, end is not None, part_number is not None,
+                    part_count is not None]):
             return web.Response(status=400)
 
-        results = await self.worker_helper.process_task(request_id, hash_target, max_length, part_number, part_count)
-        self.worker_helper.send_response(request_id, part_number, part_count, results)
+        if self.worker_helper.is_cancelled(targets.values()):
+            return web.Response(status=200)
+
+        if await self.worker_helper.process_task(targets, length, start, end, part_number, part_count):
+            for request_id in targets.values():
+                self.worker_helper.add_result(request_id, part_number, part_count, [])
+        self.worker_helper.flush_results()
 
         return web.Response(status=200)
 
+    async def handle_cancel(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        request_ids = data.get('request_ids')
+        if not request_ids:
+            return web.Response(status=400)
+        self.worker_helper.cancel(request_ids)
+        return web.Response(status=200)
+
+    async def send_heartbeat(self, leaving: bool = False) -> None:
+        heartbeat = {
+            'url': WORKER_URL,
+            'cores': WORKER_PROCESSES,
+            'hash_rate': self.worker_helper.measure_hash_rate(),
+            'leaving': leaving
+        }
+        try:
+            async with self.session.post(f"{MANAGER_URL}{MANAGER_HEARTBEAT_URL}", json=heartbeat) as response:
+                if response.status != 200:
+                    print(f"Error: Received status code {response.status}")
+        except Exception as e:
+            print(f"Exception occurred: {e}")
+
+    async def heartbeat(self) -> None:
+        while True:
+            await self.send_heartbeat()
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+
+    async def report_progress(self) -> None:
+        while True:
+            await asyncio.sleep(PROGRESS_PUSH_SECONDS)
+            progress = self.worker_helper.take_progress()
+            if not progress:
+                continue
+            try:
+                async with self.session.post(f"{MANAGER_URL}{MANAGER_PROGRESS_URL}",
+                                             json={'progress': progress}) as response:
+                    if response.status != 200:
+                        print(f"Error: Received status code {response.status}")
+            except Exception as e:
+                print(f"Exception occurred: {e}")
+
+    async def start_background_tasks(self, app: web.Application) -> None:
+        # One session for every call to the manager, so heartbeats and
+        # progress reuse pooled keep-alive connections.
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=MANAGER_TIMEOUT_SECONDS))
+        app['report_progress'] = asyncio.create_task(self.report_progress())
+        app['heartbeat'] = asyncio.create_task(self.heartbeat())
+
+    async def cleanup_background_tasks(self, app: web.Application) -> None:
+        await self.send_heartbeat(leaving=True)
+        try:
+            app['report_progress'].cancel()
+            await app['report_progress']
+            app['heartbeat'].cancel()
+            await app['heartbeat']
+        finally:
+            await self.session.close()
+
     async def handle_progress(self, request: web.Request) -> web.Response:
         if self.worker_helper.total_tasks != 0:
             return web.Response(text=f"{self.worker_helper.current_tasks/self.worker_helper.total_tasks}")
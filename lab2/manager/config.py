@@ -1,3 +1,4 @@
+import os
 from enum import Enum
 from typing import List
 
@@ -14,22 +15,79 @@ RABBIT_PASS = "admin123"
 RABBIT_MANAGER_QUEUE = "manager_queue"
 RABBIT_WORKER_TASK_QUEUE = "task_queue"
 RABBIT_WORKER_RESULTS_QUEUE = "results_queue"
+RABBIT_WORKER_PROGRESS_QUEUE = "progress_queue"
+RABBIT_CANCEL_EXCHANGE = "cancel_exchange"
+RABBIT_PREFETCH: int = 100
+MAX_ACTIVE_REQUESTS: int = 8
+MAX_QUEUED_REQUESTS: int = 1000
+RABBIT_REQUEST_PREFETCH: int = MAX_QUEUED_REQUESTS
+DEFAULT_PRIORITY: int = 0
+MAX_PRIORITY: int = 9
+PRIORITY_AGING_SECONDS: float = 60
+MAX_BACKLOG_SECONDS: float = 3600
+ADMISSION_RETRY_SECONDS: int = 10
+RABBIT_RECONNECT_SECONDS: int = 1
+RABBIT_PUBLISH_BATCH_SIZE: int = 500
+# Result messages written per bulk_write, 1 turns batching off; bounded by the prefetch
+RESULTS_BATCH_SIZE: int = RABBIT_PREFETCH
+# msgpack or json; consumers accept both whatever is set here
+MESSAGE_FORMAT: str = os.environ.get('MESSAGE_FORMAT', 'msgpack')
 
 MONGO_URI: str = "mongodb://mongo-primary:27017,mongo-secondary1:27017,mongo-secondary2:27017/?replicaSet=rs0"
 MONGO_DB_NAME: str = "crackhash"
 MONGO_COLLECTION_NAME: str = "requests"
+MONGO_SEARCHED_COLLECTION_NAME: str = "searched"
+MONGO_WORKERS_COLLECTION_NAME: str = "workers"
+MONGO_LEASES_COLLECTION_NAME: str = "leases"
+MONGO_CHUNK_LEASES_COLLECTION_NAME: str = "chunk_leases"
+MONGO_CHUNKS_COLLECTION_NAME: str = "chunks"
+MONGO_MAX_POOL_SIZE: int = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE: int = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_MAX_IDLE_TIME_MS: int = 60000
+MONGO_WAIT_QUEUE_TIMEOUT_MS: int = 10000
+MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 5000
+MONGO_CONNECT_TIMEOUT_MS: int = 5000
+MONGO_SOCKET_TIMEOUT_MS: int = 30000
+MONGO_WRITE_CONCERN = os.environ.get('MONGO_WRITE_CONCERN', 'majority')
+MONGO_WRITE_TIMEOUT_MS: int = 10000
+MONGO_READ_CONCERN: str = os.environ.get('MONGO_READ_CONCERN', 'local')
 
-WORKER_URLS: List[str] = ['http://lab1-worker-1:8080', 'http://lab1-worker-2:8080', 'http://lab1-worker-3:8080']
 MANAGER_PORT: int = 8080
 RETRY_COUNT: int = 3
 RETRY_TIMEOUT_SECONDS: int = 1
 GET_TIMEOUT_SECONDS: int = 1
 HEALTHCHECK_SECONDS: int = 3
+HEALTH_STALE_SECONDS: float = 10
+WORKERS_REFRESH_SECONDS: float = 1
+QUEUE_POSITIONS_SECONDS: float = 1
+LEADER_LEASE: str = "leader"
+LEADER_LEASE_SECONDS: float = 10
+# A chunk whose worker reports no progress for this long is handed out again
+CHUNK_LEASE_SECONDS: float = 60
 REQUEST_TIMEOUT: int = 30000
+MD5_HEX_LENGTH: int = 32
+# Candidate counts above this no longer fit Mongo's 64-bit integers
+MAX_LENGTH: int = 12
+MAX_BATCH_SIZE: int = 1000
+MAX_STATUS_BATCH_SIZE: int = 10000
+CHUNK_SIZE: int = 36 ** 5
+CHUNK_WINDOW: int = 64
+ALPHABET: str = 'abcdefghijklmnopqrstuvwxyz0123456789'
+STATUS_CACHE_SECONDS: float = 1
+STATUS_CACHE_SIZE: int = 10000
+STATUS_STREAM_SECONDS: float = 1
+STATUS_STREAM_KEEPALIVE_SECONDS: float = 15
 
 WORKER_HEALTH_URL = "/health"
 WORKER_TASK_URL = "/internal/api/worker/hash/crack/task"
 WORKER_PROGRESS_URL = "/progress"
 MANAGER_CRACK_URL = "/api/hash/crack"
+MANAGER_CRACK_BATCH_URL = "/api/hash/crack/batch"
 MANAGER_STATUS_URL = "/api/hash/status"
-MANAGER_PATCH_URL = "/internal/api/manager/hash/crack/request"
\ No newline at end of file
+MANAGER_STATUS_STREAM_URL = "/api/hash/status/stream"
+MANAGER_STATUS_BATCH_URL = "/api/hash/status/batch"
+MANAGER_PATCH_URL = "/internal/api/manager/hash/crack/request"
+MANAGER_HEARTBEAT_URL = "/internal/api/manager/workers/heartbeat"
+MANAGER_CHECKPOINT_URL = "/internal/api/manager/hash/crack/checkpoint"
+MANAGER_WORKERS_URL = "/api/workers"
+MANAGER_STORE_STATS_URL = "/api/store/stats"
\ No newline at end of file
@@ -14,7 +14,14 @@ if __name__ == '__main__':
     })
 
     app.router.add_post(MANAGER_CRACK_URL, manager.handle_crack_hash)
+    app.router.add_post(MANAGER_CRACK_BATCH_URL, manager.handle_crack_batch)
     app.router.add_get(MANAGER_STATUS_URL, manager.handle_get_status)
+    app.router.add_get(MANAGER_STATUS_STREAM_URL, manager.handle_status_stream)
+    app.router.add_post(MANAGER_STATUS_BATCH_URL, manager.handle_get_status_batch)
+    app.router.add_get(MANAGER_WORKERS_URL, manager.handle_get_workers)
+    app.router.add_post(MANAGER_HEARTBEAT_URL, manager.handle_heartbeat)
+    app.router.add_post(MANAGER_CHECKPOINT_URL, manager.handle_checkpoint)
+    app.router.add_get(MANAGER_STORE_STATS_URL, manager.handle_store_stats)
 
     for route in list(app.router.routes()):
         cors.add(route)
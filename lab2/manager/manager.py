@@ -6,12 +6,18 @@ from aiohttp import web
 import uuid
 import time
 import asyncio
-import xml.etree.ElementTree as ET
+import json
+from itertools import islice
 import logging
-from typing import Dict, Any, Optional
+import math
+import string
+from typing import Dict, Any, List, Optional, Set, Tuple
 from config import *
+from chunks import candidate_count, chunk_count, generate_chunks
 from mongo_store import MongoRequestStore
-from rabbit import RabbitMQClient
+from pymongo.errors import ConnectionFailure
+from protocol import load_results
+from rabbit import RabbitMQClient, close_connections
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,12 +27,19 @@ logging.basicConfig(
 class Manager:
     def __init__(self):
         self.request_store = MongoRequestStore()
+        self.jobs: Dict[asyncio.Task, Dict[str, Any]] = {}
+        self.pending: List[Tuple[Dict[str, Any], Any]] = []
+        # Replicas share all request and worker state through Mongo; this one
+        # only keeps the jobs it runs and caches of what the others wrote.
+        self.replica_id = str(uuid.uuid4())
+        self.queue_positions: Dict[str, int] = {}
         self.manager_queue = RabbitMQClient(
             RABBIT_HOST,
             RABBIT_PORT,
             RABBIT_USER,
             RABBIT_PASS,
-            RABBIT_MANAGER_QUEUE
+            RABBIT_MANAGER_QUEUE,
+            prefetch=RABBIT_REQUEST_PREFETCH
         )
         self.worker_task_queue = RabbitMQClient(
             RABBIT_HOST,
@@ -42,168 +55,557 @@ class Manager:
             RABBIT_PASS,
             RABBIT_WORKER_RESULTS_QUEUE
         )
-        self.manager_queue.connect()
-        self.worker_task_queue.connect()
-        self.worker_results_queue.connect()
+        self.progress_queue = RabbitMQClient(
+            RABBIT_HOST,
+            RABBIT_PORT,
+            RABBIT_USER,
+            RABBIT_PASS,
+            RABBIT_WORKER_PROGRESS_QUEUE
+        )
+        self.cancel_exchange = RabbitMQClient(
+            RABBIT_HOST,
+            RABBIT_PORT,
+            RABBIT_USER,
+            RABBIT_PASS,
+            '',
+            RABBIT_CANCEL_EXCHANGE
+        )
 
-        self.workers_list = {}
-        self.task_data = {}
+        self.status_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.streamed: Dict[str, Dict[str, Any]] = {}
+        self.workers: Dict[str, Dict[str, Any]] = {}
+
+    def live_workers(self) -> List[str]:
+        current_time = time.time()
+        return [url for url, worker in self.workers.items()
+                if current_time - worker['last_seen'] <= HEALTH_STALE_SECONDS]
+
+    def chunk_window(self) -> int:
+        # Keep enough chunks queued for every live core to have one ready.
+        return max(CHUNK_WINDOW, 2 * sum(self.workers[url]['cores'] for url in self.live_workers()))
+
+    async def drop_worker(self, worker_url: str, seen_before: Optional[float] = None) -> None:
+        self.workers.pop(worker_url, None)
+        worker = await self.request_store.remove_worker(worker_url, seen_before)
+        if not worker:
+            return
+        logging.error(f"Worker {worker_url} left")
+        # Its chunk is still unacked in task_queue and the broker redelivers
+        # it once the worker's connection is gone; the worker that picks it up
+        # takes the lease over, otherwise the lease expires and is reclaimed.
+
+    async def handle_heartbeat(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        url = data.get('url')
+        if not url:
+            return web.Response(status=400)
+        if data.get('leaving'):
+            await self.drop_worker(url)
+            return web.Response(status=200)
+        worker = {
+            'cores': data.get('cores', 1),
+            'hash_rate': data.get('hash_rate', 0),
+            'task': data.get('task'),
+            'last_seen': time.time()
+        }
+        if await self.request_store.save_worker(url, worker['cores'], worker['hash_rate'], worker['task']):
+            logging.info(f"Worker {url} joined with {data.get('cores')} cores")
+        if worker['task']:
+            await self.request_store.renew_chunk_lease(url, worker['task'], data.get('done', 0), CHUNK_LEASE_SECONDS)
+        else:
+            await self.request_store.release_chunk_leases(url)
+        self.workers[url] = worker
+        return web.Response(status=200)
+
+    async def handle_checkpoint(self, request: web.Request) -> web.Response:
+        # A worker handed a redelivered chunk asks where to carry on from;
+        # null means the chunk is already done.
+        try:
+            task_data = await request.json()
+            return web.json_response(await self.resume_task(dict(task_data)))
+        except (ValueError, KeyError, TypeError) as e:
+            return web.json_response({'error': f'Malformed task: {e}'}, status=400)
+
+    async def refresh_workers(self) -> None:
+        # Heartbeats land on whichever replica the balancer picks, so every
+        # replica reloads the shared registry to size windows and admit jobs.
+        while True:
+            try:
+                self.workers = {worker.pop('url'): worker for worker in await self.request_store.get_workers()}
+            except Exception as e:
+                logging.error(f"Exception refresh_workers {e}")
+            await asyncio.sleep(WORKERS_REFRESH_SECONDS)
 
-    async def check_worker_health(self, worker_url: str):
+    async def is_leader(self) -> bool:
+        # Duties that must run once per cluster go to the replica holding the
+        # lease; it renews the lease every round, and another replica takes
+        # over once it lapses.
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{worker_url}{WORKER_HEALTH_URL}") as response:
-                    if response.status == 200:
-                        return await response.text()
-                    else:
-                        return None
-        except:
-            return None
+            return await self.request_store.acquire_lease(LEADER_LEASE, self.replica_id, LEADER_LEASE_SECONDS)
+        except Exception as e:
+            logging.error(f"Exception is_leader {e}")
+            return False
+
+    async def handle_get_workers(self, request: web.Request) -> web.Response:
+        live = set(self.live_workers())
+        return web.json_response({
+            'workers': [{'url': url, 'cores': worker['cores'], 'hash_rate': worker['hash_rate'],
+                         'last_seen': worker['last_seen'], 'alive': url in live}
+                        for url, worker in self.workers.items()],
+            'hash_rate': self.cluster_hash_rate()
+        })
+
+    async def handle_store_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.request_store.pool_stats.snapshot())
 
     async def process_requests(self) -> None:
+        # The queue prefetch lets up to MAX_QUEUED_REQUESTS requests wait here
+        # unacknowledged; schedule() runs the best MAX_ACTIVE_REQUESTS of them.
         while True:
             try:
-                request_data, delivery_tag = await self.manager_queue.get()
+                request_data, message = await self.manager_queue.get()
                 if not request_data:
                     await asyncio.sleep(GET_TIMEOUT_SECONDS)
                     continue
+                self.pending.append((request_data, message))
+                self.schedule()
+            except Exception as e:
+                logging.error(f"Wait connect process_requests...")
+                await asyncio.sleep(GET_TIMEOUT_SECONDS)
 
-                request_id = request_data['request_id']
-                hash_target = request_data['hash']
-                max_length = request_data['max_length']
-                part_count = len(WORKER_URLS)
-
-                await self.request_store.connect()
-                request_data = await self.request_store.get_request(request_id)
-
-                if request_data["status"] != Status.NEW.value:
-                    while True:
-                        request_data = await self.request_store.get_request(request_id)
-                        if request_data["status"] in [Status.READY.value, Status.ERROR.value]:
-                            break
-                        await asyncio.sleep(GET_TIMEOUT_SECONDS)
-                    self.manager_queue.ack(delivery_tag)
-                    continue
+    def schedule(self) -> None:
+        self.pending.sort(key=lambda pending: self.rank(pending[0]))
+        while self.pending and len(self.jobs) < MAX_ACTIVE_REQUESTS:
+            request_data, message = self.pending.pop(0)
+            job = asyncio.create_task(self.run_request(request_data, message))
+            self.jobs[job] = request_data
+            job.add_done_callback(self.finish_job)
+
+    def finish_job(self, job: asyncio.Task) -> None:
+        self.jobs.pop(job, None)
+        self.schedule()
+
+    async def admit(self, cost: int) -> Tuple[Optional[int], Optional[float]]:
+        """Decide whether a new job of cost candidates can be queued.
+
+        Returns the Retry-After seconds for a refused job, or None and the
+        expected seconds until an admitted job is done (None while the
+        cluster rate is not measured yet).
+        """
+        rate = self.cluster_hash_rate()
+        # Counted over the whole cluster, so every replica admits alike.
+        stats = await self.request_store.job_stats()
+        backlog = stats['backlog']
+        queued = stats['queued']
+        if queued >= MAX_QUEUED_REQUESTS:
+            # A place frees up when a queued job starts; on average that takes
+            # the drain time of one job's share of the backlog.
+            if rate and backlog:
+                return max(1, math.ceil(backlog / rate / queued)), None
+            return ADMISSION_RETRY_SECONDS, None
+        # Work already admitted drains at the measured rate; new jobs wait
+        # while it needs more than MAX_BACKLOG_SECONDS. The new job's own size
+        # is left out, or a big job would be refused while any work is queued.
+        if rate and backlog / rate > MAX_BACKLOG_SECONDS:
+            return max(1, math.ceil(backlog / rate - MAX_BACKLOG_SECONDS)), None
+        return None, round((backlog + cost) / rate, 1) if rate else None
+
+    def too_busy(self, retry_after: int) -> web.Response:
+        return web.json_response({'error': 'Too many requests queued', 'retry_after': retry_after},
+                                 status=429, headers={'Retry-After': str(retry_after)})
+
+    def cluster_hash_rate(self) -> float:
+        return sum(self.workers[url]['hash_rate'] for url in self.live_workers())
+
+    def rank(self, request_data: Dict[str, Any]) -> Tuple[int, int]:
+        # Priority classes first and shortest job first inside a class; every
+        # PRIORITY_AGING_SECONDS in the queue lifts a request one class, so a
+        # stream of small jobs cannot starve a big one.
+        waited = time.time() - request_data.get('submitted_at', time.time())
+        priority = request_data.get('priority', DEFAULT_PRIORITY) + int(waited // PRIORITY_AGING_SECONDS)
+        return -priority, request_data.get('cost', 0)
+
+    def build_schedule(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
+        rate = self.cluster_hash_rate()
+        remaining = max(request_data['candidates_total'] - request_data['candidates_done'], 0)
+        queue_position = None
+        if request_data['status'] == Status.NEW.value:
+            queue_position = self.queue_positions.get(request_data['request_id'])
+        return {
+            'priority': request_data.get('priority', DEFAULT_PRIORITY),
+            'cost': request_data['candidates_total'],
+            'expected_seconds': round(remaining / rate, 1) if rate else None,
+            'queue_position': queue_position
+        }
 
-                await self.request_store.set_status(request_id, Status.IN_PROGRESS.value)
-
-                for part_number in range(part_count):
-                    task_data = {
-                        'request_id': request_id,
-                        'hash': hash_target,
-                        'max_length': max_length,
-                        'part_number': part_number,
-                        'part_count': part_count
-                    }
-                    self.task_data = task_data
-                    await self.worker_task_queue.push(task_data)
-
-                while True:
-                    request_data = await self.request_store.get_request(request_id)
-                    if request_data["status"] in [Status.READY.value, Status.ERROR.value]:
-                        self.manager_queue.ack(delivery_tag)
-                        break
-                    try:
-                        self.manager_queue.channel.queue_declare(queue=self.manager_queue.queue_name,
-                                                                        passive=True)
-                    except Exception as e1:
-                        logging.error(f"Wait connect...")
-                        break
-                    await asyncio.sleep(GET_TIMEOUT_SECONDS)
+    async def refresh_queue_positions(self) -> None:
+        # One read of the queued requests per tick ranks the cluster-wide
+        # queue for every status read until the next one; a batch is one job
+        # and takes one place.
+        while True:
+            try:
+                jobs: Dict[str, List[Dict[str, Any]]] = {}
+                for request_data in await self.request_store.get_queued_requests():
+                    jobs.setdefault(request_data.get('job_id', request_data['request_id']), []).append(request_data)
+                ranked = sorted(jobs.values(), key=lambda job: self.rank({
+                    'priority': job[0].get('priority', DEFAULT_PRIORITY),
+                    'submitted_at': job[0]['start_time'],
+                    'cost': job[0]['candidates_total']
+                }))
+                self.queue_positions = {request_data['request_id']: position
+                                        for position, job in enumerate(ranked, 1) for request_data in job}
             except Exception as e:
-                logging.error(f"Wait connect process_requests...")
+                logging.error(f"Exception refresh_queue_positions {e}")
+            await asyncio.sleep(QUEUE_POSITIONS_SECONDS)
+
+    async def run_request(self, request_data: Dict[str, Any], message) -> None:
+        try:
+            targets = request_data['targets']
+            max_length = request_data['max_length']
+            request_ids = list(targets.values())
+
+            priority = request_data.get('priority', DEFAULT_PRIORITY)
+
+            requests_data = await self.request_store.get_requests(request_ids)
+
+            if any(request_data["status"] != Status.NEW.value for request_data in requests_data):
+                # The replica that ran this job went away before acking it;
+                # carry on from the last batch of chunks it recorded.
+                await self.resume_request(targets, max_length, priority, requests_data)
+            else:
+                await self.request_store.set_status_many(request_ids, Status.IN_PROGRESS.value)
+
+                targets, min_length = await self.skip_searched_lengths(targets, max_length)
+                if targets:
+                    await self.publish_chunks(targets, min_length, max_length, priority)
+
+            while True:
+                if await self.requests_finished(request_ids):
+                    await self.manager_queue.ack(message)
+                    break
+                if self.manager_queue.channel.is_closed:
+                    logging.error(f"Wait connect...")
+                    break
+                await asyncio.sleep(GET_TIMEOUT_SECONDS)
+        except (KeyError, TypeError, AttributeError) as e:
+            logging.error(f"Dropping malformed request {request_data}: {e}")
+            await self.settle(message, requeue=False)
+        except Exception as e:
+            # Hand the job back to the queue; whichever replica takes it next
+            # resumes it from what the store recorded.
+            logging.error(f"Request {request_data.get('targets')} failed, requeueing: {e}")
+            await asyncio.sleep(RETRY_TIMEOUT_SECONDS)
+            await self.settle(message, requeue=True)
+
+    async def settle(self, message, requeue: bool) -> None:
+        try:
+            await self.manager_queue.nack(message, requeue=requeue)
+        except Exception as e:
+            # A closed channel hands the message back to the broker anyway.
+            logging.error(f"Failed to nack request message: {e}")
+
+    async def resume_request(self, targets: Dict[str, str], max_length: int, priority: int,
+                             requests_data: List[Dict[str, Any]]) -> None:
+        active = {request_data['request_id'] for request_data in requests_data
+                  if request_data['status'] in [Status.NEW.value, Status.IN_PROGRESS.value]}
+        targets = {hash_target: request_id for hash_target, request_id in targets.items() if request_id in active}
+        if not targets:
+            return
+        logging.info(f"Resuming requests {list(targets.values())}")
+        started = [request_data for request_data in requests_data
+                   if request_data['request_id'] in active and 'min_length' in request_data]
+        if not started:
+            await self.request_store.set_status_many(list(targets.values()), Status.IN_PROGRESS.value)
+            targets, min_length = await self.skip_searched_lengths(targets, max_length)
+            if targets:
+                await self.publish_chunks(targets, min_length, max_length, priority)
+            return
+        # Chunks published after the last recorded batch go out again; the
+        # chunk documents make the duplicates harmless.
+        min_length = started[0]['min_length']
+        parts_published = min(request_data.get('parts_published', 0) for request_data in started)
+        await self.publish_chunks(targets, min_length, max_length, priority, parts_published)
+
+    async def publish_chunks(self, targets: Dict[str, str], min_length: int, max_length: int,
+                             priority: int = DEFAULT_PRIORITY, start_part: int = 0) -> None:
+        # Chunks are generated on demand and only a window of them, sized by
+        # the live cores, waits in task_queue, so free workers keep pulling
+        # while the rest of the keyspace is never materialized.
+        request_ids = list(targets.values())
+        part_count = chunk_count(min_length, max_length)
+        if not start_part:
+            await self.request_store.set_part_count(request_ids, part_count, candidate_count(min_length, max_length),
+                                                    min_length)
+        chunks = islice(enumerate(generate_chunks(min_length, max_length)), start_part, None)
+        next_part = start_part
+        while next_part < part_count:
+            requests_data = await self.request_store.get_requests(request_ids)
+            if all(request_data["status"] in [Status.READY.value, Status.ERROR.value]
+                   for request_data in requests_data):
+                return
+            # Running jobs split the window by priority class, so their chunks
+            # interleave in task_queue and a new job does not queue behind a
+            # full window.
+            parts_received = min(request_data["parts_received"] for request_data in requests_data)
+            weights = (await self.request_store.job_stats())['weights']
+            share = self.chunk_window() * (priority + 1) // max(weights, priority + 1)
+            room = parts_received + max(1, share) - next_part
+            if room <= 0:
                 await asyncio.sleep(GET_TIMEOUT_SECONDS)
+                continue
+            batch = [{
+                'targets': targets,
+                'length': length,
+                'start': start,
+                'end': end,
+                'part_number': part_number,
+                'part_count': part_count
+            } for part_number, (length, start, end) in islice(chunks, min(room, RABBIT_PUBLISH_BATCH_SIZE))]
+            if not await self.worker_task_queue.push_many(batch):
+                logging.error(f"Parts {next_part}-{next_part + len(batch) - 1} were not confirmed, failing {request_ids}")
+                await self.request_store.set_status_many(request_ids, Status.ERROR.value)
+                return
+            next_part += len(batch)
+            await self.request_store.set_parts_published(request_ids, next_part)
+
+    async def skip_searched_lengths(self, targets: Dict[str, str], max_length: int) -> Tuple[Dict[str, str], int]:
+        searched = await self.request_store.get_searched(list(targets))
+        stop_on_first_match = {request_data['request_id']
+                               for request_data in await self.request_store.get_requests(list(targets.values()))
+                               if request_data.get('stop_on_first_match')}
+        finished = []
+        stopped = []
+        remaining: Dict[str, str] = {}
+        min_length = max_length
+        for hash_target, request_id in targets.items():
+            searched_length = 0
+            results = []
+            if hash_target in searched:
+                searched_length = searched[hash_target]['max_length']
+                results = [result for result in searched[hash_target]['results'] if len(result) <= max_length]
+                await self.request_store.add_results(request_id, results)
+            if searched_length >= max_length:
+                finished.append(request_id)
+            elif results and request_id in stop_on_first_match:
+                # A stored hit is already the first match.
+                stopped.append(request_id)
+            else:
+                remaining[hash_target] = request_id
+                min_length = min(min_length, searched_length + 1)
+        await self.request_store.set_status_many(finished + stopped, Status.READY.value)
+        return remaining, min_length
+
+    async def requests_finished(self, request_ids: List[str]) -> bool:
+        requests_data = await self.request_store.get_requests(request_ids)
+        return all(request_data["status"] in [Status.READY.value, Status.ERROR.value]
+                   for request_data in requests_data)
 
     async def process_results(self) -> None:
         while True:
             try:
-                result_data = await self.worker_results_queue.get_string(ack=True)
-                if not result_data:
-                    await asyncio.sleep(GET_TIMEOUT_SECONDS)
+                # Everything already buffered is written with one bulk_write
+                # and settled with one ack.
+                messages = await self.worker_results_queue.next_messages(RESULTS_BATCH_SIZE)
+                parsed = []
+                for message in messages:
+                    try:
+                        parsed.append((message, *load_results(message.body, message.content_type)))
+                    except Exception as e:
+                        # Redelivery cannot fix a malformed record, dead-letter it.
+                        logging.error(f"Dropping malformed result message: {e}")
+                        await message.nack(requeue=False)
+                if not parsed:
                     continue
 
-                root = ET.fromstring(result_data)
-                request_id = root.findtext('RequestId')
-                part_number = int(root.findtext('PartNumber'))
-                part_count = int(root.findtext('PartCount'))
-                results = [elem.text for elem in root.findall('Results/Result')]
-                partial = root.findtext('Partial')
-                await self.request_store.connect()
-                await self.request_store.update_request(request_id, results, partial)
+                results = [result for _, message_results, _ in parsed for result in message_results]
+                checkpoints = [checkpoint for _, _, message_checkpoints in parsed for checkpoint in message_checkpoints]
+                try:
+                    stopped = await self.request_store.apply_results(results, checkpoints)
+                except ConnectionFailure:
+                    await parsed[-1][0].nack(multiple=True)
+                    raise
+                except Exception as e:
+                    logging.error(f"Batch of {len(parsed)} result messages failed ({e}), applying one by one")
+                    stopped = await self.apply_results_one_by_one(parsed)
+                else:
+                    await parsed[-1][0].ack(multiple=True)
+
+                if stopped:
+                    logging.info(f"Requests {stopped} found a match, cancelling their chunks")
+                    await self.cancel_exchange.push({'request_ids': stopped})
 
             except Exception as e:
                 logging.error(f"Wait connect process_results...")
                 await asyncio.sleep(GET_TIMEOUT_SECONDS)
 
-    async def handle_crack_hash(self, request: web.Request) -> web.Response:
-        for url in WORKER_URLS:
-            health_check = False
-            for _ in range(RETRY_COUNT + 1):
-                if await self.check_worker_health(url):
-                    health_check = True
-                    break
-                else:
-                    logging.error(f"Worker {url} unavailable. Retry...")
-                    await asyncio.sleep(RETRY_TIMEOUT_SECONDS)
-            if not health_check:
-                return web.json_response({'error': 'One or more workers are down'}, status=500)
+    async def apply_results_one_by_one(self, parsed: List[Tuple[Any, list, list]]) -> List[str]:
+        stopped = []
+        for index, (message, results, checkpoints) in enumerate(parsed):
+            try:
+                stopped += await self.request_store.apply_results(results, checkpoints)
+            except ConnectionFailure:
+                for pending, _, _ in parsed[index:]:
+                    await pending.nack()
+                raise
+            except Exception as e:
+                logging.error(f"Dropping result message the store rejects: {e}")
+                await message.nack(requeue=False)
+                continue
+            await message.ack()
+        return stopped
+
+    async def process_progress(self) -> None:
+        while True:
+            try:
+                progress_data, _ = await self.progress_queue.get(ack=True)
+                if not progress_data:
+                    await asyncio.sleep(GET_TIMEOUT_SECONDS)
+                    continue
 
+                for entry in progress_data.get('progress', []):
+                    await self.request_store.add_progress(entry['request_ids'], entry['count'])
+
+            except Exception as e:
+                logging.error(f"Wait connect process_progress...")
+                await asyncio.sleep(GET_TIMEOUT_SECONDS)
+
+    async def check_workers(self) -> bool:
+        return bool(self.live_workers())
+
+    def normalize_hash(self, hash_target: Any) -> Optional[str]:
+        # Workers turn targets into digests with bytes.fromhex, so one bad
+        # hash would fail its whole batch, and hashes differing only in case
+        # would share a digest; both are settled here, before any lookup.
+        if not isinstance(hash_target, str) or len(hash_target) != MD5_HEX_LENGTH:
+            return None
+        if any(char not in string.hexdigits for char in hash_target):
+            return None
+        return hash_target.lower()
+
+    async def handle_crack_hash(self, request: web.Request) -> web.Response:
         data = await request.json()
         hash_target = data.get('hash')
         max_length = data.get('maxLength')
+        stop_on_first_match = bool(data.get('stopOnFirstMatch', False))
+        priority = data.get('priority', DEFAULT_PRIORITY)
 
         if not hash_target or not max_length:
             return web.json_response({'error': 'Missing hash or maxLength'}, status=400)
+        if not isinstance(max_length, int) or isinstance(max_length, bool) or not 1 <= max_length <= MAX_LENGTH:
+            return web.json_response({'error': f'maxLength must be an integer from 1 to {MAX_LENGTH}'}, status=400)
+        hash_target = self.normalize_hash(hash_target)
+        if not hash_target:
+            return web.json_response({'error': f'hash must be {MD5_HEX_LENGTH} hex characters'}, status=400)
+        if not isinstance(priority, int) or isinstance(priority, bool) or not 0 <= priority <= MAX_PRIORITY:
+            return web.json_response({'error': f'priority must be an integer from 0 to {MAX_PRIORITY}'}, status=400)
 
-        request_id = str(uuid.uuid4())
-        part_count = len(WORKER_URLS)
-        await self.request_store.connect()
-        await self.request_store.create_request(request_id, part_count)
-        await self.manager_queue.push({
-            'request_id': request_id,
-            'hash': hash_target,
-            'max_length': max_length
-        })
-
-        return web.json_response({'RequestId': request_id})
-
-    async def handle_get_status(self, request: web.Request) -> web.Response:
-        request_id = request.query.get('requestId')
-        if not request_id:
-            return web.json_response({'error': 'Missing requestId'}, status=400)
+        request_data = await self.request_store.find_known_request(hash_target, max_length)
+        if request_data:
+            return web.json_response({'RequestId': request_data['request_id'], 'status': request_data['status']})
 
-        await self.request_store.connect()
+        if not await self.check_workers():
+            return web.json_response({'error': 'No workers available'}, status=500)
 
-        request_data = await self.request_store.get_request(request_id)
-        if not request_data:
-            return web.json_response({'error': 'Invalid requestId'}, status=404)
+        retry_after, eta_seconds = await self.admit(candidate_count(1, max_length))
+        if retry_after is not None:
+            return self.too_busy(retry_after)
 
-        await self.request_store.check_timeouts()
+        request_id = str(uuid.uuid4())
+        part_count = chunk_count(1, max_length)
+        # The lookup above is only a shortcut; the insert decides which of
+        # two racing submissions runs.
+        request_data = await self.request_store.create_request(request_id, part_count, hash_target, max_length,
+                                                               stop_on_first_match, priority)
+        if request_data:
+            return web.json_response({'RequestId': request_data['request_id'], 'status': request_data['status']})
+        await self.manager_queue.push({
+            'targets': {hash_target: request_id},
+            'max_length': max_length,
+            'priority': priority,
+            'cost': candidate_count(1, max_length),
+            'submitted_at': time.time()
+        })
 
-        part_count = len(WORKER_URLS)
+        return web.json_response({'RequestId': request_id, 'status': Status.NEW.value, 'eta_seconds': eta_seconds})
 
+    async def handle_crack_batch(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        hashes = data.get('hashes')
+        max_length = data.get('maxLength')
+        stop_on_first_match = bool(data.get('stopOnFirstMatch', False))
+        priority = data.get('priority', DEFAULT_PRIORITY)
+
+        if not hashes or not isinstance(hashes, list) or not max_length:
+            return web.json_response({'error': 'Missing hashes or maxLength'}, status=400)
+        if not isinstance(max_length, int) or isinstance(max_length, bool) or not 1 <= max_length <= MAX_LENGTH:
+            return web.json_response({'error': f'maxLength must be an integer from 1 to {MAX_LENGTH}'}, status=400)
+        if len(hashes) > MAX_BATCH_SIZE:
+            return web.json_response({'error': f'Batch is larger than {MAX_BATCH_SIZE} hashes'}, status=400)
+        hashes = [self.normalize_hash(hash_target) for hash_target in hashes]
+        if not all(hashes):
+            return web.json_response({'error': f'Every hash must be {MD5_HEX_LENGTH} hex characters'}, status=400)
+        if not isinstance(priority, int) or isinstance(priority, bool) or not 0 <= priority <= MAX_PRIORITY:
+            return web.json_response({'error': f'priority must be an integer from 0 to {MAX_PRIORITY}'}, status=400)
+
+        request_ids: Dict[str, str] = {}
+        targets: Dict[str, str] = {}
+        for hash_target in hashes:
+            if hash_target in request_ids:
+                continue
+            request_data = await self.request_store.find_known_request(hash_target, max_length)
+            if request_data:
+                request_ids[hash_target] = request_data['request_id']
+            else:
+                request_ids[hash_target] = targets[hash_target] = str(uuid.uuid4())
+
+        eta_seconds = None
+        if targets:
+            if not await self.check_workers():
+                return web.json_response({'error': 'No workers available'}, status=500)
+            retry_after, eta_seconds = await self.admit(candidate_count(1, max_length))
+            if retry_after is not None:
+                return self.too_busy(retry_after)
+
+            part_count = chunk_count(1, max_length)
+            existing = await self.request_store.create_requests(targets, part_count, max_length,
+                                                                stop_on_first_match, priority)
+            for hash_target, request_data in existing.items():
+                request_ids[hash_target] = request_data['request_id']
+                del targets[hash_target]
+
+        if targets:
+            await self.manager_queue.push({
+                'targets': targets,
+                'max_length': max_length,
+                'priority': priority,
+                'cost': candidate_count(1, max_length),
+                'submitted_at': time.time()
+            })
+
+        return web.json_response({'RequestIds': [request_ids[hash_target] for hash_target in hashes],
+                                  'eta_seconds': eta_seconds})
+
+    def format_progress(self, request_data: Dict[str, Any]) -> str:
+        # Workers push candidate counts, so progress moves inside long chunks
+        # too; redelivered chunks may overcount, hence the cap below 100%.
         total_percentage = 0
         if request_data['status'] == Status.IN_PROGRESS.value:
-            for part_number in range(part_count):
-                percent = await self.get_progress(request_id, WORKER_URLS[part_number])
-                logging.info(f"Gen: {percent}")
-                total_percentage += float(percent)
-            total_percentage -= request_data['parts_received']
-            logging.info(f"parts_received: {request_data['parts_received'] / request_data['part_count']}")
-
-            total_percentage = ((total_percentage / len(WORKER_URLS)
-                                + request_data['parts_received']/request_data['part_count'])
-                                * 100)
+            if request_data['candidates_total']:
+                share = request_data['candidates_done'] / request_data['candidates_total']
+            else:
+                share = request_data['parts_received'] / request_data['part_count'] if request_data['part_count'] else 0
+            total_percentage = min(share * 100, 99)
         elif request_data['status'] == Status.NEW.value:
             total_percentage = 0
         elif request_data['status'] == Status.READY.value:
             total_percentage = 100
+        return f"{total_percentage:.0f}%"
 
+    def build_status(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
         status = request_data['status']
-        part_count = request_data['part_count']
-        parts_received = request_data['parts_received']
-        progress_str = f"{total_percentage:.0f}%"
-        results = request_data['results']
+        progress_str = self.format_progress(request_data)
+        results = list(request_data['results'])
 
         response_data = {
             'status': status,
@@ -214,67 +616,206 @@ class Manager:
         if status == Status.READY.value:
             response_data['data'] = results
             del response_data['partial_result']
+        elif status in [Status.NEW.value, Status.IN_PROGRESS.value]:
+            response_data['schedule'] = self.build_schedule(request_data)
+
+        return response_data
+
+    def cache_status(self, request_id: str, response_data: Dict[str, Any]) -> None:
+        current_time = time.time()
+        if len(self.status_cache) >= STATUS_CACHE_SIZE:
+            self.status_cache = {key: value for key, value in self.status_cache.items() if value[0] > current_time}
+        self.status_cache[request_id] = (current_time + STATUS_CACHE_SECONDS, response_data)
+
+    async def handle_get_status(self, request: web.Request) -> web.Response:
+        request_id = request.query.get('requestId')
+        if not request_id:
+            return web.json_response({'error': 'Missing requestId'}, status=400)
+
+        snapshot = self.status_cache.get(request_id)
+        if snapshot and snapshot[0] > time.time():
+            return web.json_response(snapshot[1])
+
+        request_data = await self.request_store.get_request(request_id)
+        if not request_data:
+            return web.json_response({'error': 'Invalid requestId'}, status=404)
 
+        response_data = self.build_status(request_data)
+        self.cache_status(request_id, response_data)
         return web.json_response(response_data)
 
-    async def get_progress(self, request_id: str, worker_url: str) -> Optional[str]:
-        for _ in range(RETRY_COUNT + 1):
+    async def handle_get_status_batch(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        request_ids = data.get('requestIds')
+        changed_since = data.get('changedSince', 0)
+
+        if not isinstance(request_ids, list) or not request_ids:
+            return web.json_response({'error': 'Missing requestIds'}, status=400)
+        if len(request_ids) > MAX_STATUS_BATCH_SIZE:
+            return web.json_response({'error': f'Too many requestIds, max {MAX_STATUS_BATCH_SIZE}'}, status=400)
+        if not isinstance(changed_since, (int, float)):
+            return web.json_response({'error': 'changedSince must be a timestamp'}, status=400)
+
+        # Taken before the read, so a change racing with it shows up again on
+        # the next poll instead of being lost.
+        timestamp = time.time()
+        statuses = {
+            request_data['request_id']: {'status': request_data['status'],
+                                         'progress': self.format_progress(request_data)}
+            for request_data in await self.request_store.get_statuses(request_ids, changed_since)
+        }
+        return web.json_response({'statuses': statuses, 'timestamp': timestamp})
+
+    async def status_broadcaster(self) -> None:
+        # One store read per tick for all subscribed requests, fanned out to
+        # every open stream, so watchers do not multiply the load.
+        while True:
+            await asyncio.sleep(STATUS_STREAM_SECONDS)
+            if not self.subscribers:
+                continue
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(
-                        f"{worker_url}{WORKER_PROGRESS_URL}"
-                    ) as response:
-                        if response.status != 200:
-                            logging.error(f"Worker {worker_url} failed for request")
-                        else:
-                            return await response.text()
+                for request_data in await self.request_store.get_requests(list(self.subscribers)):
+                    request_id = request_data['request_id']
+                    status_data = self.build_status(request_data)
+                    self.cache_status(request_id, status_data)
+                    if self.streamed.get(request_id) == status_data:
+                        continue
+                    self.streamed[request_id] = status_data
+                    for queue in self.subscribers.get(request_id, set()):
+                        queue.put_nowait(status_data)
             except Exception as e:
-                logging.error(f"Get progress {request_id} failed for {worker_url}: {str(e)} \n Retry...")
-                await asyncio.sleep(RETRY_TIMEOUT_SECONDS)
-        logging.error(f"Get progress {request_id} failed for {worker_url} \n Maximum number of retry attempts reached")
-        return "0"
+                logging.error(f"Exception status_broadcaster {e}")
 
-    async def workers_monitoring(self):
-        while True:
-            for url in WORKER_URLS:
-                part_number = None
-                for _ in range(RETRY_COUNT + 1):
-                    part_number = await self.check_worker_health(url)
-                    if part_number:
-                        break
-                    else:
-                        logging.error(f"Worker {url} unavailable. Retry...")
-                        await asyncio.sleep(RETRY_TIMEOUT_SECONDS)
-
-                if part_number:
-                    self.workers_list[url] = part_number
-                else:
-                    if self.workers_list[url]:
-                        logging.error(f"Worker {url} unavailable. Resubmitting a task...")
-                        self.task_data["part_number"] = int(self.workers_list[url])
-                        await self.worker_task_queue.push(self.task_data)
-                        self.workers_list[url] = None
+    async def send_event(self, response: web.StreamResponse, status_data: Dict[str, Any]) -> None:
+        await response.write(f"data: {json.dumps(status_data)}\n\n".encode())
+
+    async def handle_status_stream(self, request: web.Request) -> web.StreamResponse:
+        request_id = request.query.get('requestId')
+        if not request_id:
+            return web.json_response({'error': 'Missing requestId'}, status=400)
+
+        request_data = await self.request_store.get_request(request_id)
+        if not request_data:
+            return web.json_response({'error': 'Invalid requestId'}, status=404)
 
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
 
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(request_id, set()).add(queue)
+        try:
+            status_data = self.build_status(request_data)
+            await self.send_event(response, status_data)
+            while status_data['status'] not in [Status.READY.value, Status.ERROR.value]:
+                try:
+                    status_data = await asyncio.wait_for(queue.get(), timeout=STATUS_STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    await response.write(b": keepalive\n\n")
+                    continue
+                await self.send_event(response, status_data)
+        except ConnectionResetError:
+            pass
+        finally:
+            subscribers = self.subscribers.get(request_id)
+            subscribers.discard(queue)
+            if not subscribers:
+                del self.subscribers[request_id]
+                self.streamed.pop(request_id, None)
+        return response
+
+    async def resume_task(self, task_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        part_number = task_data['part_number']
+        requests_data = await self.request_store.get_requests(list(task_data['targets'].values()))
+        pending = [request_data for request_data in requests_data
+                   if request_data["status"] == Status.IN_PROGRESS.value]
+        if not pending:
+            return None
+        if await self.request_store.is_chunk_done(pending[0].get("job_id", pending[0]["request_id"]), part_number):
+            return None
+        offset = min(request_data["checkpoints"].get(str(part_number), task_data['start'])
+                     for request_data in pending)
+        task_data['start'] = max(task_data['start'], offset)
+        return task_data
+
+    async def workers_monitoring(self):
+        while True:
             await asyncio.sleep(HEALTHCHECK_SECONDS)
+            if not await self.is_leader():
+                continue
+            try:
+                await self.reclaim_chunk_leases()
+            except Exception as e:
+                logging.error(f"Exception reclaim_chunk_leases {e}")
+            stale_before = time.time() - HEALTH_STALE_SECONDS
+            for url, worker in list(self.workers.items()):
+                if worker['last_seen'] < stale_before:
+                    try:
+                        await self.drop_worker(url, stale_before)
+                    except Exception as e:
+                        logging.error(f"Exception workers_monitoring {e}")
+
+    async def reclaim_chunk_leases(self) -> None:
+        # A worker that still heartbeats but has made no progress on its chunk
+        # for CHUNK_LEASE_SECONDS is stuck; its chunk goes out again from the
+        # last checkpoint, unless it was finished meanwhile.
+        while True:
+            lease = await self.request_store.take_expired_chunk_lease()
+            if not lease:
+                return
+            try:
+                task_data = await self.resume_task(dict(lease['task']))
+                if not task_data:
+                    continue
+                logging.error(f"Lease of chunk {task_data['part_number']} held by {lease['owner']} expired, "
+                              f"resubmitting from offset {task_data['start']}...")
+                published = await self.worker_task_queue.push_many([task_data])
+            except Exception:
+                await self.request_store.restore_chunk_lease(lease)
+                raise
+            if not published:
+                # The lease stays expired, so the next round tries again.
+                await self.request_store.restore_chunk_lease(lease)
+                return
 
     async def background_timeout_checker(self, app: web.Application) -> None:
         while True:
             await asyncio.sleep(HEALTHCHECK_SECONDS)
-            await self.request_store.check_timeouts()
+            if await self.is_leader():
+                await self.request_store.check_timeouts()
 
     async def start_background_tasks(self, app: web.Application) -> None:
+        await self.request_store.connect()
+        await self.manager_queue.connect()
+        await self.worker_task_queue.connect()
+        await self.worker_results_queue.connect()
+        await self.progress_queue.connect()
+        await self.cancel_exchange.connect()
+        app['refresh_workers'] = asyncio.create_task(self.refresh_workers())
+        app['refresh_queue_positions'] = asyncio.create_task(self.refresh_queue_positions())
         app['process_requests'] = asyncio.create_task(self.process_requests())
         app['process_results'] = asyncio.create_task(self.process_results())
+        app['process_progress'] = asyncio.create_task(self.process_progress())
         app['workers_monitoring'] = asyncio.create_task(self.workers_monitoring())
         app['background_timeout_checker'] = asyncio.create_task(self.background_timeout_checker(app))
+        app['status_broadcaster'] = asyncio.create_task(self.status_broadcaster())
 
     async def cleanup_background_tasks(self, app: web.Application) -> None:
-        app['process_requests'].cancel()
-        await app['process_requests']
-        app['process_results'].cancel()
-        await app['process_results']
-        app['workers_monitoring'].cancel()
-        await app['workers_monitoring']
-        app['background_timeout_checker'].cancel()
-        await app['background_timeout_checker']
+        # Stop everything that still uses the store and the broker before
+        # closing them; unfinished jobs go back to the queue with the channel.
+        tasks = [app[name] for name in ['refresh_workers', 'refresh_queue_positions', 'process_requests',
+                                        'process_results', 'process_progress', 'workers_monitoring',
+                                        'background_timeout_checker', 'status_broadcaster']]
+        # Nothing may be scheduled in place of the cancelled jobs.
+        self.pending.clear()
+        tasks += list(self.jobs)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.request_store.close()
+        for client in [self.manager_queue, self.worker_task_queue, self.worker_results_queue,
+                       self.progress_queue, self.cancel_exchange]:
+            try:
+                await client.close()
+            except Exception as e:
+                logging.error(f"Failed to close channel: {e}")
+        await close_connections()
@@ -1,57 +1,550 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.monitoring import ConnectionPoolListener
 from config import *
-from typing import Dict, Any, Optional, List
+from chunks import candidate_count
+from protocol import CheckpointRecord, ResultRecord
+from typing import Dict, Any, Optional, List, Set
+import asyncio
+import logging
+from datetime import datetime
+import threading
 import time
+import uuid
+
+
+class PoolStats(ConnectionPoolListener):
+    """Counts connection pool events; the driver calls it from its own threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.clears = 0
+        self.wait_started: Dict[int, List[float]] = {}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'max_pool_size': MONGO_MAX_POOL_SIZE,
+                'open': self.open,
+                'in_use': self.in_use,
+                'waiting': self.waiting,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'avg_wait_ms': self.wait_seconds * 1000 / self.checkouts if self.checkouts else 0,
+                'max_wait_ms': self.max_wait_seconds * 1000,
+                'clears': self.clears
+            }
+
+    def _wait_done(self) -> float:
+        started = self.wait_started.get(threading.get_ident())
+        self.waiting -= 1
+        return time.monotonic() - started.pop() if started else 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self.lock:
+            self.clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self.lock:
+            self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.open -= 1
+
+    def connection_check_out_started(self, event):
+        with self.lock:
+            self.waiting += 1
+            self.wait_started.setdefault(threading.get_ident(), []).append(time.monotonic())
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self._wait_done()
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            wait = self._wait_done()
+            self.in_use += 1
+            self.checkouts += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.in_use -= 1
+
 
 class MongoRequestStore:
+    """One pooled client per process, opened by connect() at startup."""
+
     def __init__(self):
         self.client = None
         self.db = None
         self.collection = None
+        self.searched = None
+        self.workers = None
+        self.leases = None
+        self.chunk_leases = None
+        self.chunks = None
+        self.pool_stats = PoolStats()
 
     async def connect(self):
-        self.client = AsyncIOMotorClient(MONGO_URI)
+        if self.client is not None:
+            return
+        self.client = AsyncIOMotorClient(
+            MONGO_URI,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            w=MONGO_WRITE_CONCERN,
+            wTimeoutMS=MONGO_WRITE_TIMEOUT_MS,
+            readConcernLevel=MONGO_READ_CONCERN,
+            event_listeners=[self.pool_stats]
+        )
         self.db = self.client[MONGO_DB_NAME]
         self.collection = self.db[MONGO_COLLECTION_NAME]
-        await self._create_indexes()
+        self.searched = self.db[MONGO_SEARCHED_COLLECTION_NAME]
+        self.workers = self.db[MONGO_WORKERS_COLLECTION_NAME]
+        self.leases = self.db[MONGO_LEASES_COLLECTION_NAME]
+        self.chunk_leases = self.db[MONGO_CHUNK_LEASES_COLLECTION_NAME]
+        self.chunks = self.db[MONGO_CHUNKS_COLLECTION_NAME]
+        while True:
+            try:
+                await self._create_indexes()
+                break
+            except Exception as e:
+                logging.error(f"Wait mongo: {e}")
+                await asyncio.sleep(RETRY_TIMEOUT_SECONDS)
+
+    def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+            self.client = None
 
     async def _create_indexes(self):
         await self.collection.create_index("request_id", unique=True)
         await self.collection.create_index("status")
         await self.collection.create_index("start_time")
+        await self.collection.create_index("job_id")
+        await self.collection.create_index([("hash", 1), ("max_length", 1), ("alphabet", 1), ("status", 1)])
+        # At most one exhaustive run per key may be NEW or IN_PROGRESS, so two
+        # identical submissions racing on different replicas share one run.
+        # Partial indexes take no $in; NEW and IN_PROGRESS are exactly the
+        # statuses sorting between ERROR and READY.
+        await self.collection.create_index(
+            [("hash", 1), ("max_length", 1), ("alphabet", 1)],
+            name="active_request",
+            unique=True,
+            partialFilterExpression={
+                "stop_on_first_match": False,
+                "status": {"$gt": Status.ERROR.value, "$lt": Status.READY.value}
+            }
+        )
+        await self.searched.create_index([("hash", 1), ("alphabet", 1)], unique=True)
+        await self.workers.create_index("url", unique=True)
+        await self.chunk_leases.create_index("owner")
+        await self.chunk_leases.create_index("deadline")
+        # A finished chunk only has to be remembered while its job may run.
+        await self.chunks.create_index("done_at", expireAfterSeconds=REQUEST_TIMEOUT)
 
-    async def create_request(self, request_id: str, part_count: int) -> None:
-        document = {
+    def _new_document(self, request_id: str, part_count: int, hash_target: str, max_length: int,
+                      stop_on_first_match: bool, priority: int, job_id: str) -> Dict[str, Any]:
+        return {
             "request_id": request_id,
+            "job_id": job_id,
             "status": "NEW",
             "results": [],
             "parts_received": 0,
             "part_count": part_count,
+            "checkpoints": {},
+            "candidates_done": 0,
+            "candidates_total": candidate_count(1, max_length),
             "start_time": time.time(),
+            "updated_at": time.time(),
             "timeout": REQUEST_TIMEOUT,
-            "delivery_tag": 0
-        }
-        await self.collection.insert_one(document)
-
-    async def update_request(self, request_id: str, results: List[str], partial: str) -> None:
-        request_data = await self.get_request(request_id)
-        update_op = {
-            "$addToSet": {"results": {"$each": results}},
-            "$inc": {"parts_received": 1} if partial == "False" else {},
-            "$set": {"status": Status.READY.value} if
-                request_data["parts_received"] == (request_data["part_count"] - 1)
-                and partial == "False" else {}
+            "delivery_tag": 0,
+            "hash": hash_target,
+            "max_length": max_length,
+            "alphabet": ALPHABET,
+            "stop_on_first_match": stop_on_first_match,
+            "priority": priority
         }
+
+    async def create_request(self, request_id: str, part_count: int, hash_target: str, max_length: int,
+                             stop_on_first_match: bool = False,
+                             priority: int = DEFAULT_PRIORITY) -> Optional[Dict[str, Any]]:
+        """Insert a request; returns the request that already serves the key instead, if there is one."""
+        while True:
+            try:
+                await self.collection.insert_one(
+                    self._new_document(request_id, part_count, hash_target, max_length, stop_on_first_match,
+                                       priority, request_id)
+                )
+                return None
+            except DuplicateKeyError:
+                existing = await self.find_known_request(hash_target, max_length)
+                if existing:
+                    return existing
+
+    async def create_requests(self, targets: Dict[str, str], part_count: int, max_length: int,
+                              stop_on_first_match: bool = False,
+                              priority: int = DEFAULT_PRIORITY) -> Dict[str, Dict[str, Any]]:
+        """Insert a batch; returns, by hash, the requests that already serve some of its keys."""
+        # The requests of one batch are searched in one pass, so they share a job.
+        job_id = str(uuid.uuid4())
+        existing: Dict[str, Dict[str, Any]] = {}
+        request_ids = dict(targets)
+        while targets:
+            try:
+                await self.collection.insert_many([
+                    self._new_document(request_id, part_count, hash_target, max_length, stop_on_first_match,
+                                       priority, job_id)
+                    for hash_target, request_id in targets.items()
+                ], ordered=False)
+                break
+            except BulkWriteError as e:
+                taken = [error["op"]["hash"] for error in e.details["writeErrors"] if error["code"] == 11000]
+                if len(taken) < len(e.details["writeErrors"]):
+                    raise
+                targets = {}
+                for hash_target in taken:
+                    request_data = await self.find_known_request(hash_target, max_length)
+                    if request_data:
+                        existing[hash_target] = request_data
+                    else:
+                        targets[hash_target] = request_ids[hash_target]
+        return existing
+
+    async def find_known_request(self, hash_target: str, max_length: int) -> Optional[Dict[str, Any]]:
+        request_data = await self.find_ready_request(hash_target, max_length)
+        if request_data:
+            return request_data
+        return await self.find_active_request(hash_target, max_length)
+
+    # A stop-on-first-match run may end before it has searched everything,
+    # so neither lookup hands one out for a later submission.
+    async def find_ready_request(self, hash_target: str, max_length: int) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({
+            "hash": hash_target,
+            "max_length": max_length,
+            "alphabet": ALPHABET,
+            "stop_on_first_match": {"$ne": True},
+            "status": Status.READY.value
+        })
+
+    async def find_active_request(self, hash_target: str, max_length: int) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({
+            "hash": hash_target,
+            "max_length": max_length,
+            "alphabet": ALPHABET,
+            "stop_on_first_match": {"$ne": True},
+            "status": {"$in": [Status.NEW.value, Status.IN_PROGRESS.value]}
+        })
+
+    def _chunk_id(self, job_id: str, part_number: int) -> str:
+        return f"{job_id}:{part_number}"
+
+    def _becomes_ready(self, finished: List[Dict[str, Any]], batch: str) -> Dict[str, Any]:
+        becomes_ready = {"$and": [{"$eq": ["$status", Status.IN_PROGRESS.value]}, {"$or": finished}]}
+        return {"$set": {
+            "status": {"$cond": [becomes_ready, Status.READY.value, "$status"]},
+            "ready_batch": {"$cond": [becomes_ready, batch, "$ready_batch"]}
+        }}
+
+    def _hits_update(self, request_id: str, results: List[str], batch: str) -> UpdateOne:
+        return UpdateOne({"request_id": request_id}, [
+            {"$set": {
+                "results": {"$concatArrays": ["$results", {"$filter": {
+                    "input": {"$literal": results},
+                    "cond": {"$not": [{"$in": ["$$this", "$results"]}]}
+                }}]},
+                "updated_at": time.time()
+            }},
+            self._becomes_ready([{"$eq": ["$stop_on_first_match", True]}], batch)
+        ])
+
+    def _part_update(self, job_id: str, part_number: int, batch: str) -> UpdateMany:
+        # The part is counted once for every request of the job still
+        # running, and the status flips from the counter it has just changed.
+        return UpdateMany({"job_id": job_id, "status": Status.IN_PROGRESS.value}, [
+            {"$set": {"parts_received": {"$add": ["$parts_received", 1]}, "updated_at": time.time()}},
+            self._becomes_ready([{"$gte": ["$parts_received", "$part_count"]}], batch),
+            {"$unset": f"checkpoints.{part_number}"}
+        ])
+
+    async def _apply_results(self, session, results: List[ResultRecord], checkpoints: List[CheckpointRecord],
+                             batch: str) -> Set[str]:
+        request_ids = {result[0] for result in results}
+        for checkpoint in checkpoints:
+            request_ids.update(checkpoint[0])
+        jobs = {}
+        async for request_data in self.collection.find({"request_id": {"$in": list(request_ids)}},
+                                                       {"request_id": 1, "job_id": 1}, session=session):
+            jobs[request_data["request_id"]] = request_data.get("job_id", request_data["request_id"])
+
+        # A finished part has a chunk document, so a redelivered completion
+        # or a late checkpoint of that part changes nothing.
+        parts = {(jobs[request_id], part_number)
+                 for request_id, part_number, part_count, words, partial in results
+                 if not partial and request_id in jobs}
+        parts.update((jobs[request_id], part_number)
+                     for checkpoint_ids, part_number, length, offset in checkpoints
+                     for request_id in checkpoint_ids if request_id in jobs)
+        done = set()
+        if parts:
+            chunk_ids = [self._chunk_id(job_id, part_number) for job_id, part_number in parts]
+            async for chunk in self.chunks.find({"_id": {"$in": chunk_ids}},
+                                                {"job_id": 1, "part_number": 1}, session=session):
+                done.add((chunk["job_id"], chunk["part_number"]))
+
+        operations = []
+        for checkpoint_ids, part_number, length, offset in checkpoints:
+            pending = [request_id for request_id in checkpoint_ids
+                       if request_id in jobs and (jobs[request_id], part_number) not in done]
+            if pending:
+                operations.append(UpdateMany(
+                    {"request_id": {"$in": pending}, "status": Status.IN_PROGRESS.value},
+                    {"$max": {f"checkpoints.{part_number}": offset}}
+                ))
+        hits: Dict[str, List[str]] = {}
+        for request_id, part_number, part_count, words, partial in results:
+            if words:
+                hits.setdefault(request_id, []).extend(words)
+        operations += [self._hits_update(request_id, words, batch) for request_id, words in hits.items()]
+
+        finished = {(jobs[request_id], part_number)
+                    for request_id, part_number, part_count, words, partial in results
+                    if not partial and request_id in jobs} - done
+        if finished:
+            await self.chunks.insert_many([
+                {"_id": self._chunk_id(job_id, part_number), "job_id": job_id, "part_number": part_number,
+                 "done_at": datetime.utcnow()}
+                for job_id, part_number in finished
+            ], session=session)
+            operations += [self._part_update(job_id, part_number, batch) for job_id, part_number in finished]
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False, session=session)
+        return set(jobs.values())
+
+    async def apply_results(self, results: List[ResultRecord], checkpoints: List[CheckpointRecord]) -> List[str]:
+        """Write a batch of worker results and checkpoints in one transaction.
+
+        The transaction keeps a chunk document and the count it stands for
+        together, so a part is counted exactly once.
+
+        Returns the requests stopped by a match, whose chunks should be cancelled.
+        """
+        if not results and not checkpoints:
+            return []
+        batch = uuid.uuid4().hex
+        async with await self.client.start_session() as session:
+            job_ids = await session.with_transaction(
+                lambda session: self._apply_results(session, results, checkpoints, batch)
+            )
+        if not results:
+            return []
+
+        stopped = []
+        finished = self.collection.find(
+            {"job_id": {"$in": list(job_ids)}, "ready_batch": batch},
+            {"request_id": 1, "hash": 1, "max_length": 1, "results": 1, "stop_on_first_match": 1}
+        )
+        async for request_data in finished:
+            if request_data.get("stop_on_first_match", False) and request_data["results"]:
+                stopped.append(request_data["request_id"])
+            else:
+                await self.record_searched(request_data["hash"], request_data["max_length"], request_data["results"])
+        return stopped
+
+    async def is_chunk_done(self, job_id: str, part_number: int) -> bool:
+        return await self.chunks.find_one({"_id": self._chunk_id(job_id, part_number)}, {"_id": 1}) is not None
+
+    async def record_searched(self, hash_target: str, max_length: int, results: List[str]) -> None:
+        await self.searched.update_one(
+            {"hash": hash_target, "alphabet": ALPHABET},
+            {
+                "$max": {"max_length": max_length},
+                "$addToSet": {"results": {"$each": results}}
+            },
+            upsert=True
+        )
+
+    async def get_searched(self, hash_targets: List[str]) -> Dict[str, Dict[str, Any]]:
+        documents = await self.searched.find(
+            {"hash": {"$in": hash_targets}, "alphabet": ALPHABET}
+        ).to_list(length=None)
+        return {document["hash"]: document for document in documents}
+
+    async def add_results(self, request_id: str, results: List[str]) -> None:
         await self.collection.update_one(
             {"request_id": request_id},
-            update_op
+            {"$addToSet": {"results": {"$each": results}}, "$set": {"updated_at": time.time()}}
         )
 
     async def set_status(self, request_id: str, status: str) -> None:
         await self.collection.update_one(
             {"request_id": request_id},
             {
-                "$set": {"status": status}
+                "$set": {"status": status, "updated_at": time.time()}
+            }
+        )
+
+    async def set_part_count(self, request_ids: List[str], part_count: int, candidates_total: int,
+                             min_length: int) -> None:
+        await self.collection.update_many(
+            {"request_id": {"$in": request_ids}},
+            {
+                "$set": {
+                    "part_count": part_count,
+                    "candidates_total": candidates_total,
+                    "min_length": min_length,
+                    "parts_published": 0,
+                    "updated_at": time.time(),
+                    "checkpoints": {}
+                }
+            }
+        )
+
+    async def set_parts_published(self, request_ids: List[str], parts_published: int) -> None:
+        await self.collection.update_many(
+            {"request_id": {"$in": request_ids}},
+            {"$max": {"parts_published": parts_published}}
+        )
+
+    async def job_stats(self) -> Dict[str, int]:
+        """Count queued jobs, the candidates left in all active jobs and the priority weights of running ones."""
+        stats = await self.collection.aggregate([
+            {"$match": {"status": {"$in": [Status.NEW.value, Status.IN_PROGRESS.value]}}},
+            {"$group": {
+                "_id": {"$ifNull": ["$job_id", "$request_id"]},
+                "status": {"$first": "$status"},
+                "priority": {"$first": {"$ifNull": ["$priority", DEFAULT_PRIORITY]}},
+                "remaining": {"$max": {"$subtract": ["$candidates_total", "$candidates_done"]}}
+            }},
+            {"$group": {
+                "_id": None,
+                "queued": {"$sum": {"$cond": [{"$eq": ["$status", Status.NEW.value]}, 1, 0]}},
+                "backlog": {"$sum": {"$max": ["$remaining", 0]}},
+                "weights": {"$sum": {"$cond": [{"$eq": ["$status", Status.IN_PROGRESS.value]},
+                                               {"$add": ["$priority", 1]}, 0]}}
+            }}
+        ]).to_list(length=None)
+        if not stats:
+            return {"queued": 0, "backlog": 0, "weights": 0}
+        return {"queued": stats[0]["queued"], "backlog": stats[0]["backlog"], "weights": stats[0]["weights"]}
+
+    async def get_queued_requests(self) -> List[Dict[str, Any]]:
+        return await self.collection.find(
+            {"status": Status.NEW.value},
+            {"_id": 0, "request_id": 1, "job_id": 1, "priority": 1, "start_time": 1, "candidates_total": 1}
+        ).to_list(length=None)
+
+    async def save_worker(self, url: str, cores: int, hash_rate: float, task: Optional[Dict[str, Any]]) -> bool:
+        """Record a heartbeat; returns True for a worker that was not registered."""
+        result = await self.workers.update_one(
+            {"url": url},
+            {"$set": {"cores": cores, "hash_rate": hash_rate, "task": task, "last_seen": time.time()}},
+            upsert=True
+        )
+        return result.upserted_id is not None
+
+    async def get_workers(self) -> List[Dict[str, Any]]:
+        return await self.workers.find({}, {"_id": 0}).to_list(length=None)
+
+    async def remove_worker(self, url: str, seen_before: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        # Only one replica gets the document back, so only one resumes its task;
+        # seen_before keeps a worker that has just sent a heartbeat.
+        query: Dict[str, Any] = {"url": url}
+        if seen_before is not None:
+            query["last_seen"] = {"$lt": seen_before}
+        return await self.workers.find_one_and_delete(query)
+
+    async def acquire_lease(self, name: str, owner: str, seconds: float) -> bool:
+        """Take or renew the named lease; True while owner holds it."""
+        current_time = time.time()
+        try:
+            lease = await self.leases.find_one_and_update(
+                {"_id": name, "$or": [{"owner": owner}, {"expires": {"$lt": current_time}}]},
+                {"$set": {"owner": owner, "expires": current_time + seconds}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return False
+        return lease is not None and lease["owner"] == owner
+
+    async def renew_chunk_lease(self, owner: str, task: Dict[str, Any], done: int, seconds: float) -> None:
+        """Record that owner works on the chunk of task; the deadline moves only while done grows."""
+        current_time = time.time()
+        lease_id = f"{min(task['targets'].values())}:{task['part_number']}"
+        await self.chunk_leases.update_one(
+            {"_id": lease_id},
+            [{"$set": {
+                "deadline": {"$cond": [
+                    {"$or": [{"$ne": ["$owner", owner]}, {"$gt": [done, {"$ifNull": ["$done", -1]}]}]},
+                    current_time + seconds,
+                    "$deadline"
+                ]},
+                "owner": owner,
+                "done": done,
+                "task": {"$literal": task}
+            }}],
+            upsert=True
+        )
+        # A worker runs one chunk at a time, so its other leases are finished.
+        await self.chunk_leases.delete_many({"owner": owner, "_id": {"$ne": lease_id}})
+
+    async def release_chunk_leases(self, owner: str) -> None:
+        await self.chunk_leases.delete_many({"owner": owner})
+
+    async def take_expired_chunk_lease(self) -> Optional[Dict[str, Any]]:
+        # Deleting the lease claims it, so one reclaim per expired chunk.
+        return await self.chunk_leases.find_one_and_delete({"deadline": {"$lt": time.time()}})
+
+    async def restore_chunk_lease(self, lease: Dict[str, Any]) -> None:
+        # Put back a claimed lease whose chunk could not be republished; a
+        # worker that took the chunk over meanwhile keeps its own lease.
+        try:
+            await self.chunk_leases.insert_one(lease)
+        except DuplicateKeyError:
+            pass
+
+    async def add_progress(self, request_ids: List[str], count: int) -> None:
+        await self.collection.update_many(
+            {"request_id": {"$in": request_ids}, "status": Status.IN_PROGRESS.value},
+            {"$inc": {"candidates_done": count}, "$set": {"updated_at": time.time()}}
+        )
+
+    async def set_status_many(self, request_ids: List[str], status: str) -> None:
+        await self.collection.update_many(
+            {"request_id": {"$in": request_ids}},
+            {
+                "$set": {"status": status, "updated_at": time.time()}
             }
         )
 
@@ -70,21 +563,27 @@ class MongoRequestStore:
                 "status": "IN_PROGRESS",
                 "start_time": {"$lt": current_time - REQUEST_TIMEOUT}
             },
-            {"$set": {"status": "ERROR"}}
+            {"$set": {"status": "ERROR", "updated_at": current_time}}
         )
 
     async def get_request(self, request_id: str) -> Optional[Dict[str, Any]]:
         return await self.collection.find_one({"request_id": request_id})
 
+    async def get_requests(self, request_ids: List[str]) -> List[Dict[str, Any]]:
+        return await self.collection.find({"request_id": {"$in": request_ids}}).to_list(length=None)
+
+    async def get_statuses(self, request_ids: List[str], changed_since: float = 0) -> List[Dict[str, Any]]:
+        return await self.collection.find(
+            {"request_id": {"$in": request_ids}, "updated_at": {"$gt": changed_since}},
+            {"_id": 0, "request_id": 1, "status": 1, "parts_received": 1, "part_count": 1,
+             "candidates_done": 1, "candidates_total": 1}
+        ).to_list(length=None)
+
     async def mark_worker_failed(self, request_id: str) -> None:
         await self.collection.update_one(
             {"request_id": request_id},
             {
                 "$inc": {"parts_received": 1},
-                "$set": {"status": "ERROR"}
+                "$set": {"status": "ERROR", "updated_at": time.time()}
             }
         )
-
-    async def close(self):
-        if self.client:
-            self.client.close()
\ No newline at end of file
@@ -1,20 +1,56 @@
-import json
-import uuid
-from time import sleep
-
-import pika
-from typing import Dict, Any, Optional, Union
-from pika.connection import Connection
-from pika.channel import Channel
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage, AbstractRobustConnection
+from typing import Dict, Any, List, Optional, Tuple
 import logging
 import asyncio
+import time
 from config import *
+from protocol import content_type_for, dump_message, load_message
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+_connections: Dict[Tuple[str, int, str], AbstractRobustConnection] = {}
+_connection_lock: Optional[asyncio.Lock] = None
+
+
+async def get_connection(host: str, port: int, username: str, password: str) -> AbstractRobustConnection:
+    """Return the process-wide connection to the broker, opening it on first use.
+
+    The connection is robust: after a network failure it reconnects on its own
+    and restores every channel, queue, QoS setting and consumer opened on it.
+    """
+    global _connection_lock
+    if _connection_lock is None:
+        _connection_lock = asyncio.Lock()
+    key = (host, int(port), username)
+    async with _connection_lock:
+        if key not in _connections:
+            while True:
+                try:
+                    _connections[key] = await aio_pika.connect_robust(
+                        host=host, port=int(port), login=username, password=password
+                    )
+                    logging.info(f"Connection done")
+                    break
+                except Exception as e:
+                    logging.error(f"Wait connect()")
+                    await asyncio.sleep(RABBIT_RECONNECT_SECONDS)
+        return _connections[key]
+
+
+async def close_connections() -> None:
+    """Close every broker connection opened by this process."""
+    while _connections:
+        _, connection = _connections.popitem()
+        try:
+            await connection.close()
+        except Exception as e:
+            logging.error(f"Failed to close connection: {e}")
+
+
 class RabbitMQClient:
     """RabbitMQ client for sending and receiving dictionaries."""
 
@@ -26,42 +62,59 @@ class RabbitMQClient:
             port: int = 5672,
             username: str = 'admin',
             password: str = 'admin123',
-            queue_name: str = 'default_queue'
+            queue_name: str = 'default_queue',
+            exchange: str = '',
+            prefetch: int = RABBIT_PREFETCH,
+            content_type: str = content_type_for(MESSAGE_FORMAT)
     ):
         """Initialize RabbitMQ client with connection parameters."""
-        self.connection_params = pika.ConnectionParameters(
-            host=host,
-            port=port,
-            credentials=pika.PlainCredentials(username, password),
-            heartbeat=60000,
-            blocked_connection_timeout=30000
-        )
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
         self.queue_name = queue_name
-        self.connection: Optional[Connection] = None
-        self.channel: Optional[Channel] = None
-
-    def __enter__(self):
-        """Context manager entry - establishes connection."""
-        self.connect()
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """Context manager exit - closes connection."""
-        self.close()
-
-    def connect(self) -> None:
-        """Establish connection and channel."""
-        self.connection = pika.BlockingConnection(self.connection_params)
-        self.channel = self.connection.channel()
-        self.channel.queue_declare(
-            queue=self.queue_name,
-            durable=True
-        )
-
-    def close(self) -> None:
-        """Close connection if it exists."""
-        if self.connection and self.connection.is_open:
-            self.connection.close()
+        self.exchange_name = exchange
+        self.prefetch = prefetch
+        self.content_type = content_type
+        self.channel: Optional[AbstractChannel] = None
+        self.exchange = None
+        self.queue = None
+        self.messages: Optional[asyncio.Queue] = None
+        self.consumer_tag: Optional[str] = None
+
+    async def connect(self) -> None:
+        """Open a channel on the shared connection and declare the queue (or the fanout exchange to publish to)."""
+        connection = await get_connection(self.host, self.port, self.username, self.password)
+        self.messages = asyncio.Queue()
+        self.channel = await connection.channel(publisher_confirms=True)
+        await self.channel.set_qos(prefetch_count=self.prefetch)
+        if self.exchange_name:
+            self.exchange = await self.channel.declare_exchange(
+                self.exchange_name, aio_pika.ExchangeType.FANOUT, durable=True
+            )
+        else:
+            self.exchange = self.channel.default_exchange
+            self.queue = await self.channel.declare_queue(self.queue_name, durable=True)
+
+    async def close(self) -> None:
+        """Close the channel if it is open."""
+        if self.channel and not self.channel.is_closed:
+            await self.channel.close()
+
+    async def publish(self, body: bytes, content_type: str) -> bool:
+        try:
+            await self.exchange.publish(
+                aio_pika.Message(
+                    body=body,
+                    content_type=content_type,
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+                ),
+                routing_key='' if self.exchange_name else self.queue_name
+            )
+            return True
+        except Exception as e:
+            logging.error(f"Failed to send message: {e}")
+            return False
 
     async def push(self, message: MessageType) -> bool:
         """
@@ -73,123 +126,104 @@ class RabbitMQClient:
         Returns:
             bool: True if message was sent successfully
         """
-        connect = True
-        try:
-            self.channel.queue_declare(queue=self.queue_name, passive=True)
-        except Exception as e:
-            logging.error(f"Connection not established...")
-            connect = False
-        if not connect:
-            while True:
-                try:
-                    self.connect()
-                    if self.channel and self.channel.is_open:
-                        logging.info(f"Connection done")
-                        break
-                except Exception as e:
-                    logging.error(f"Wait connect()")
-                    await asyncio.sleep(GET_TIMEOUT_SECONDS)
+        return await self.publish(dump_message(message, self.content_type), self.content_type)
 
-        try:
-            self.channel.basic_publish(
-                exchange='',
-                routing_key=self.queue_name,
-                body=json.dumps(message),
-                properties=pika.BasicProperties(
-                    content_type='application/json',
-                    delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE
-                )
-            )
-            return True
-        except (pika.exceptions.AMQPError, json.JSONDecodeError) as e:
-            logging.error(f"Failed to send message: {e}")
-            return False
-
-    async def get(self, ack: bool = False):
+    async def push_many(self, messages: List[MessageType]) -> bool:
         """
-        Get a single message from the queue.
+        Push a batch of dictionaries and wait until the broker confirms all of them.
+
+        The whole batch is written without waiting for each confirm in turn;
+        messages that were nacked or lost are published again, up to
+        RETRY_COUNT times.
 
         Args:
-            :param ack: If True, automatically acknowledge receipt
+            messages: Dictionaries to send
 
         Returns:
-            Optional dictionary with message content or None if queue is empty
+            bool: True if every message was confirmed
         """
-        connect = True
-        try:
-            self.channel.queue_declare(queue=self.queue_name, passive=True)
-        except Exception as e:
-            logging.error(f"Connection not established...")
-            connect = False
-        if not connect:
-            while True:
-                try:
-                    self.connect()
-                    if self.channel and self.channel.is_open:
-                        logging.info(f"Connection done")
-                        break
-                except Exception as e:
-                    logging.error(f"Wait connect()")
-                    await asyncio.sleep(GET_TIMEOUT_SECONDS)
-
-        method_frame, properties, body = self.channel.basic_get(
-            queue=self.queue_name,
-            auto_ack=ack
-        )
-
-        if not method_frame:
-            return None, None
+        bodies = [dump_message(message, self.content_type) for message in messages]
+        pending = list(range(len(bodies)))
+        for attempt in range(RETRY_COUNT):
+            started = time.monotonic()
+            confirmed = await asyncio.gather(*(self.publish(bodies[i], self.content_type) for i in pending))
+            sent = len(pending)
+            pending = [i for i, ok in zip(pending, confirmed) if not ok]
+            logging.info(f"Batch to {self.queue_name}: {sent - len(pending)}/{sent} confirmed "
+                         f"in {(time.monotonic() - started) * 1000:.1f} ms (attempt {attempt + 1})")
+            if not pending:
+                return True
+            await asyncio.sleep(RETRY_TIMEOUT_SECONDS)
+        logging.error(f"Batch to {self.queue_name}: {len(pending)}/{len(bodies)} messages unconfirmed")
+        return False
+
+    async def push_string(self, message: str) -> bool:
+        """
+        Push a string to the queue.
 
-        try:
-            if properties.content_type != 'application/json':
-                raise ValueError("Non-JSON message received")
+        Args:
+            message: String to send
 
-            message = json.loads(body.decode())
-            if not isinstance(message, dict):
-                raise ValueError("Message is not a dictionary")
+        Returns:
+            bool: True if message was sent successfully
+        """
+        return await self.publish(message.encode(), 'text/plain')
+
+    async def next_message(self, ack: bool) -> AbstractIncomingMessage:
+        # The broker pushes up to `prefetch` unacknowledged messages into the
+        # local buffer, so waiting here costs no polling round trips.
+        if self.consumer_tag is None:
+            self.consumer_tag = await self.queue.consume(self.messages.put)
+        message = await self.messages.get()
+        if ack:
+            await message.ack()
+        return message
+
+    async def next_messages(self, limit: int) -> List[AbstractIncomingMessage]:
+        """Wait for a message, then take whatever else is already buffered, up to limit.
+
+        The messages are not acknowledged; ack(multiple=True) on the last one
+        settles the whole batch.
+        """
+        messages = [await self.next_message(ack=False)]
+        while len(messages) < limit and not self.messages.empty():
+            messages.append(self.messages.get_nowait())
+        return messages
 
-            return message, method_frame.delivery_tag
+    async def get(self, ack: bool = False):
+        """
+        Wait for the next message from the queue.
 
-        except (json.JSONDecodeError, UnicodeDecodeError, ValueError) as e:
-            logging.error(f"Failed to process message: {e}")
-            self.channel.basic_nack(method_frame.delivery_tag, requeue=False)
-            return None, None
+        Args:
+            :param ack: If True, acknowledge the message as soon as it is received
 
-    async def get_string(self, ack: bool = False) -> Optional[str]:
+        Returns:
+            Tuple of the message dictionary and the message to pass to ack()
+        """
+        while True:
+            message = await self.next_message(ack)
+            try:
+                return load_message(message.body, message.content_type), message
+            except Exception as e:
+                logging.error(f"Failed to process message: {e}")
+                if not ack:
+                    await message.nack(requeue=False)
+
+    async def get_string(self, ack: bool = False) -> str:
         """
-        Get a single message from the queue.
+        Wait for the next message from the queue.
 
         Args:
-            :param ack: If True, automatically acknowledge receipt
+            :param ack: If True, acknowledge the message as soon as it is received
 
         Returns:
-            Optional dictionary with message content or None if queue is empty
+            Message body as a string
         """
-        connect = True
-        try:
-            self.channel.queue_declare(queue=self.queue_name, passive=True)
-        except Exception as e:
-            logging.error(f"Connection not established...")
-            connect = False
-        if not connect:
-            while True:
-                try:
-                    self.connect()
-                    if self.channel and self.channel.is_open:
-                        logging.info(f"Connection done")
-                        break
-                except Exception as e:
-                    logging.error(f"Wait connect()")
-                    await asyncio.sleep(GET_TIMEOUT_SECONDS)
-
-        method_frame, properties, body = self.channel.basic_get(
-            queue=self.queue_name,
-            auto_ack=ack
-        )
-        if not method_frame:
-            return None
+        message = await self.next_message(ack)
+        return message.body.decode()
 
-        return body.decode()
+    async def ack(self, message: AbstractIncomingMessage):
+        await message.ack()
 
-    def ack(self, delivery_tag: int):
-        self.channel.basic_ack(delivery_tag)
+    async def nack(self, message: AbstractIncomingMessage, requeue: bool = True):
+        await message.nack(requeue=requeue)
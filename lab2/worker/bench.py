@@ -0,0 +1,51 @@
+import hashlib
+import sys
+import time
+from typing import List
+from config import *
+from search import search_range
+from md5_numpy import search_range_numpy, verify_numpy_engine
+
+BENCH_LENGTHS = [4, 5, 6]
+BENCH_CANDIDATES = 36 ** 4
+
+
+def num_to_word_reference(num: int, length: int) -> str:
+    chars = ""
+    for _ in range(length):
+        num, rem = divmod(num, 36)
+        chars += ALPHABET[rem]
+    return chars
+
+
+def search_range_reference(hash_target: str, length: int, start: int, end: int) -> List[str]:
+    results = []
+    for word_num in range(start, end):
+        word = num_to_word_reference(word_num, length)
+        if hashlib.md5(word.encode()).hexdigest() == hash_target:
+            results.append(word)
+    return results
+
+
+def measure(search, hash_target: str, length: int, count: int) -> float:
+    start = (36 ** length - count) // 2
+    if search is not search_range_reference:
+        hash_target = frozenset([bytes.fromhex(hash_target)])
+    begin = time.perf_counter()
+    search(hash_target, length, start, start + count)
+    return count / (time.perf_counter() - begin)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else BENCH_CANDIDATES
+    hash_target = hashlib.md5(b'not-in-keyspace').hexdigest()
+    numpy_ready = verify_numpy_engine()
+    print(f"{'length':>6} {'before, c/s':>14} {'after, c/s':>14} {'speedup':>8} {'numpy, c/s':>14} {'speedup':>8}")
+    for length in BENCH_LENGTHS:
+        before = measure(search_range_reference, hash_target, length, count)
+        after = measure(search_range, hash_target, length, count)
+        line = f"{length:>6} {before:>14,.0f} {after:>14,.0f} {after / before:>7.2f}x"
+        if numpy_ready:
+            vectorized = measure(search_range_numpy, hash_target, length, count)
+            line += f" {vectorized:>14,.0f} {vectorized / before:>7.2f}x"
+        print(line)
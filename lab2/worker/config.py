@@ -1,3 +1,6 @@
+import os
+import socket
+
 RABBIT_HOST = "rabbitmq"
 RABBIT_PORT = "5672"
 RABBIT_USER = "admin"
@@ -5,13 +8,38 @@ RABBIT_PASS = "admin123"
 RABBIT_MANAGER_QUEUE = "manager_queue"
 RABBIT_WORKER_TASK_QUEUE = "task_queue"
 RABBIT_WORKER_RESULTS_QUEUE = "results_queue"
+RABBIT_WORKER_PROGRESS_QUEUE = "progress_queue"
+RABBIT_CANCEL_EXCHANGE = "cancel_exchange"
+RABBIT_PREFETCH = 100
+RABBIT_TASK_PREFETCH = 1
+RABBIT_RECONNECT_SECONDS = 1
+# msgpack, or json to send tasks and progress as JSON and results as XML
+MESSAGE_FORMAT = os.environ.get('MESSAGE_FORMAT', 'msgpack')
 
 WORKER_PORT = 8080
+WORKER_URL = os.environ.get('WORKER_URL', f'http://{socket.gethostname()}:{WORKER_PORT}')
 GET_TIMEOUT_SECONDS: int = 1
 MANAGER_URL = 'http://manager:8080'
 ALPHABET = 'abcdefghijklmnopqrstuvwxyz0123456789'
 
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', os.cpu_count() or 1))
+SUBRANGES_PER_PROCESS = 4
+PROGRESS_STEP = 10000
+PROGRESS_POLL_SECONDS = 0.5
+WORKER_ENGINE = os.environ.get('WORKER_ENGINE', 'hashlib')
+NUMPY_BLOCK_SIZE = 36 ** 3
+INDEX_DIR = os.environ.get('INDEX_DIR', 'index')
+INDEX_MAX_LENGTH = 5
+INDEX_PREFIX_BYTES = 8
+CANCELLED_HISTORY = 10000
+PROGRESS_PUSH_SECONDS = 1
+HEARTBEAT_SECONDS = 3
+MANAGER_TIMEOUT_SECONDS = 5
+CHECKPOINT_SECONDS = 10
+
 WORKER_TASK_URL = "/internal/api/worker/hash/crack/task"
 WORKER_HEALTH_URL = "/health"
 WORKER_PROGRESS_URL = "/progress"
-MANAGER_PATCH_URL = "/internal/api/manager/hash/crack/request"
\ No newline at end of file
+MANAGER_PATCH_URL = "/internal/api/manager/hash/crack/request"
+MANAGER_HEARTBEAT_URL = "/internal/api/manager/workers/heartbeat"
+MANAGER_CHECKPOINT_URL = "/internal/api/manager/hash/crack/checkpoint"
\ No newline at end of file
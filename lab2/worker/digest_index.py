@@ -0,0 +1,78 @@
+import hashlib
+import mmap
+import os
+import logging
+from typing import Dict, List
+from config import *
+from search import num_to_word
+
+# Every record is the first INDEX_PREFIX_BYTES of a digest followed by the
+# candidate number as a little-endian uint32; records are sorted by prefix.
+RECORD_SIZE = INDEX_PREFIX_BYTES + 4
+
+
+def index_path(length: int) -> str:
+    return os.path.join(INDEX_DIR, f"md5_{length}.idx")
+
+
+class DigestIndex:
+    def __init__(self):
+        self.files = []
+        self.tables: Dict[int, mmap.mmap] = {}
+
+    def open(self) -> None:
+        for length in range(1, INDEX_MAX_LENGTH + 1):
+            path = index_path(length)
+            if not os.path.exists(path) or os.path.getsize(path) != RECORD_SIZE * 36 ** length:
+                continue
+            file = open(path, 'rb')
+            table = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            if not self.check_table(table, length):
+                logging.warning(f"Index {path} does not match the alphabet, ignoring it")
+                table.close()
+                file.close()
+                continue
+            self.files.append(file)
+            self.tables[length] = table
+
+    def check_table(self, table: mmap.mmap, length: int) -> bool:
+        count = 36 ** length
+        for record in {0, count // 2, count - 1}:
+            offset = record * RECORD_SIZE
+            num = int.from_bytes(table[offset + INDEX_PREFIX_BYTES:offset + RECORD_SIZE], 'little')
+            digest = hashlib.md5(num_to_word(num, length).encode()).digest()
+            if digest[:INDEX_PREFIX_BYTES] != table[offset:offset + INDEX_PREFIX_BYTES]:
+                return False
+        return True
+
+    def has_length(self, length: int) -> bool:
+        return length in self.tables
+
+    def lookup(self, digest: bytes, length: int) -> List[int]:
+        table = self.tables[length]
+        prefix = digest[:INDEX_PREFIX_BYTES]
+        low, high = 0, len(table) // RECORD_SIZE
+        while low < high:
+            middle = (low + high) // 2
+            offset = middle * RECORD_SIZE
+            if table[offset:offset + INDEX_PREFIX_BYTES] < prefix:
+                low = middle + 1
+            else:
+                high = middle
+
+        nums = []
+        offset = low * RECORD_SIZE
+        while offset < len(table) and table[offset:offset + INDEX_PREFIX_BYTES] == prefix:
+            num = int.from_bytes(table[offset + INDEX_PREFIX_BYTES:offset + RECORD_SIZE], 'little')
+            if hashlib.md5(num_to_word(num, length).encode()).digest() == digest:
+                nums.append(num)
+            offset += RECORD_SIZE
+        return nums
+
+    def close(self) -> None:
+        for table in self.tables.values():
+            table.close()
+        for file in self.files:
+            file.close()
+        self.tables = {}
+        self.files = []
@@ -8,4 +8,5 @@ if __name__ == '__main__':
     app.router.add_get(WORKER_PROGRESS_URL, worker.handle_progress)
 
     app.on_startup.append(worker.start_background_tasks)
+    app.on_cleanup.append(worker.cleanup_background_tasks)
     web.run_app(app, port=WORKER_PORT)
\ No newline at end of file
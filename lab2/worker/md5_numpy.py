@@ -0,0 +1,108 @@
+import hashlib
+import math
+import random
+from typing import FrozenSet, List
+from config import *
+from search import cancelled, num_to_word, report_progress
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SHIFTS = [7, 12, 17, 22] * 4 + [5, 9, 14, 20] * 4 + [4, 11, 16, 23] * 4 + [6, 10, 15, 21] * 4
+CONSTANTS = [int(abs(math.sin(i + 1)) * 2 ** 32) & 0xFFFFFFFF for i in range(64)]
+INITIAL_STATE = [0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476]
+
+
+def message_index(step: int) -> int:
+    if step < 16:
+        return step
+    if step < 32:
+        return (5 * step + 1) % 16
+    if step < 48:
+        return (3 * step + 5) % 16
+    return (7 * step) % 16
+
+
+def build_block(length: int, start: int, end: int):
+    # One row per candidate: the word, the 0x80 terminator and the bit length,
+    # laid out as the single 64-byte MD5 block a word this short fits in.
+    nums = np.arange(start, end, dtype=np.int64)
+    alphabet = np.frombuffer(ALPHABET.encode(), dtype=np.uint8)
+    block = np.zeros((end - start, 64), dtype=np.uint8)
+    for position in range(length - 1, -1, -1):
+        nums, digits = np.divmod(nums, 36)
+        block[:, position] = alphabet[digits]
+    block[:, length] = 0x80
+    block[:, 56:64] = np.frombuffer((length * 8).to_bytes(8, 'little'), dtype=np.uint8)
+    return block.view('<u4')
+
+
+def md5_block(block) -> List:
+    # Columns that are equal for every row (the shared prefix, padding and
+    # length) are folded into scalars so only the varying words cost a vector op.
+    words = []
+    for column in block.T:
+        if (column == column[0]).all():
+            words.append(np.uint32(column[0]))
+        else:
+            words.append(np.ascontiguousarray(column))
+
+    a, b, c, d = (np.full(block.shape[0], value, dtype=np.uint32) for value in INITIAL_STATE)
+    for step in range(64):
+        if step < 16:
+            f = (b & c) | (~b & d)
+        elif step < 32:
+            f = (d & b) | (~d & c)
+        elif step < 48:
+            f = b ^ c ^ d
+        else:
+            f = c ^ (b | ~d)
+        f = f + a + np.uint32(CONSTANTS[step]) + words[message_index(step)]
+        shift = SHIFTS[step]
+        a, d, c = d, c, b
+        b = b + ((f << np.uint32(shift)) | (f >> np.uint32(32 - shift)))
+    return [
+        a + np.uint32(INITIAL_STATE[0]),
+        b + np.uint32(INITIAL_STATE[1]),
+        c + np.uint32(INITIAL_STATE[2]),
+        d + np.uint32(INITIAL_STATE[3])
+    ]
+
+
+def md5_range(length: int, start: int, end: int):
+    return np.stack(md5_block(build_block(length, start, end)), axis=1)
+
+
+def search_range_numpy(targets: FrozenSet[bytes], length: int, start: int, end: int) -> List[str]:
+    # Only the first digest word is compared across the block; the few rows
+    # that hit one of the targets there are checked against the full digests.
+    target_words = np.frombuffer(b''.join(targets), dtype='<u4')[::4]
+    results: List[str] = []
+    for block_start in range(start, end, NUMPY_BLOCK_SIZE):
+        block_end = min(block_start + NUMPY_BLOCK_SIZE, end)
+        a, b, c, d = md5_block(build_block(length, block_start, block_end))
+        for index in np.flatnonzero(np.isin(a, target_words)):
+            digest = np.array([a[index], b[index], c[index], d[index]], dtype='<u4').tobytes()
+            if digest in targets:
+                results.append(num_to_word(block_start + int(index), length))
+        report_progress(block_end - block_start)
+        if cancelled():
+            break
+    return results
+
+
+def verify_numpy_engine(samples: int = 8, block_size: int = 512) -> bool:
+    if np is None:
+        return False
+    for _ in range(samples):
+        length = random.randint(1, 8)
+        start = random.randrange(max(36 ** length - block_size, 1))
+        end = min(start + block_size, 36 ** length)
+        digests = md5_range(length, start, end).astype('<u4')
+        for offset, digest in enumerate(digests):
+            expected = hashlib.md5(num_to_word(start + offset, length).encode()).digest()
+            if digest.tobytes() != expected:
+                return False
+    return True
@@ -1,19 +1,45 @@
-import json
-from time import sleep
-
-import pika
-from typing import Dict, Any, Optional, Union
-from pika.connection import Connection
-from pika.channel import Channel
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage, AbstractRobustConnection
+from typing import Dict, Any, Optional, Tuple
 import logging
 import asyncio
 from config import *
+from protocol import content_type_for, dump_message, load_message
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+_connections: Dict[Tuple[str, int, str], AbstractRobustConnection] = {}
+_connection_lock: Optional[asyncio.Lock] = None
+
+
+async def get_connection(host: str, port: int, username: str, password: str) -> AbstractRobustConnection:
+    """Return the process-wide connection to the broker, opening it on first use.
+
+    The connection is robust: after a network failure it reconnects on its own
+    and restores every channel, queue, QoS setting and consumer opened on it.
+    """
+    global _connection_lock
+    if _connection_lock is None:
+        _connection_lock = asyncio.Lock()
+    key = (host, int(port), username)
+    async with _connection_lock:
+        if key not in _connections:
+            while True:
+                try:
+                    _connections[key] = await aio_pika.connect_robust(
+                        host=host, port=int(port), login=username, password=password
+                    )
+                    logging.info(f"Connection done")
+                    break
+                except Exception as e:
+                    logging.error(f"Wait connect()")
+                    await asyncio.sleep(RABBIT_RECONNECT_SECONDS)
+        return _connections[key]
+
+
 class RabbitMQClient:
     """RabbitMQ client for sending and receiving dictionaries."""
 
@@ -25,44 +51,69 @@ class RabbitMQClient:
             port: int = 5672,
             username: str = 'admin',
             password: str = 'admin123',
-            queue_name: str = 'default_queue'
+            queue_name: str = 'default_queue',
+            exchange: str = '',
+            prefetch: int = RABBIT_PREFETCH,
+            content_type: str = content_type_for(MESSAGE_FORMAT)
     ):
         """Initialize RabbitMQ client with connection parameters."""
-        self.connection_params = pika.ConnectionParameters(
-            host=host,
-            port=port,
-            credentials=pika.PlainCredentials(username, password),
-            heartbeat=60000,
-            blocked_connection_timeout=30000
-        )
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
         self.queue_name = queue_name
-        self.connection: Optional[Connection] = None
-        self.channel: Optional[Channel] = None
-
-    def __enter__(self):
-        """Context manager entry - establishes connection."""
-        self.connect()
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """Context manager exit - closes connection."""
-        self.close()
-
-    def connect(self) -> None:
-        """Establish connection and channel."""
-        self.connection = pika.BlockingConnection(self.connection_params)
-        self.channel = self.connection.channel()
-        self.channel.queue_declare(
-            queue=self.queue_name,
-            durable=True
-        )
-
-    def close(self) -> None:
-        """Close connection if it exists."""
-        if self.connection and self.connection.is_open:
-            self.connection.close()
+        self.exchange_name = exchange
+        self.prefetch = prefetch
+        self.content_type = content_type
+        self.channel: Optional[AbstractChannel] = None
+        self.exchange = None
+        self.queue = None
+        self.messages: Optional[asyncio.Queue] = None
+        self.consumer_tag: Optional[str] = None
+
+    async def connect(self) -> None:
+        """Open a channel on the shared connection and declare the queue.
+
+        With an exchange set, the client gets its own exclusive queue bound to
+        the fanout exchange, so every worker receives every broadcast.
+        """
+        connection = await get_connection(self.host, self.port, self.username, self.password)
+        self.messages = asyncio.Queue()
+        # With confirms a publish returns only once the broker holds the
+        # message, so a task is never acked ahead of its results.
+        self.channel = await connection.channel(publisher_confirms=True)
+        await self.channel.set_qos(prefetch_count=self.prefetch)
+        if self.exchange_name:
+            self.exchange = await self.channel.declare_exchange(
+                self.exchange_name, aio_pika.ExchangeType.FANOUT, durable=True
+            )
+            self.queue = await self.channel.declare_queue(exclusive=True)
+            await self.queue.bind(self.exchange)
+        else:
+            self.exchange = self.channel.default_exchange
+            self.queue = await self.channel.declare_queue(self.queue_name, durable=True)
+
+    async def close(self) -> None:
+        """Close the channel if it is open."""
+        if self.channel and not self.channel.is_closed:
+            await self.channel.close()
+
+    async def publish(self, body: bytes, content_type: str) -> bool:
+        try:
+            await self.exchange.publish(
+                aio_pika.Message(
+                    body=body,
+                    content_type=content_type,
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+                ),
+                routing_key='' if self.exchange_name else self.queue_name
+            )
+            return True
+        except Exception as e:
+            logging.error(f"Failed to send message: {e}")
+            return False
 
-    async def push_string(self, message: str) -> bool:
+    async def push(self, message: MessageType) -> bool:
         """
         Push a dictionary to the queue.
 
@@ -72,81 +123,51 @@ class RabbitMQClient:
         Returns:
             bool: True if message was sent successfully
         """
-        try:
-            self.channel.queue_declare(queue=self.queue_name, passive=True)
-        except Exception as e1:
-            logging.error(f"Connection not established... Wait connect")
-            while True:
-                try:
-                    self.connect()
-                    if self.channel and self.channel.is_open:
-                        logging.info(f"Connection done")
-                        break
-                except Exception as e:
-                    logging.error(f"Wait connect()")
-                    await asyncio.sleep(GET_TIMEOUT_SECONDS)
+        return await self.publish(dump_message(message, self.content_type), self.content_type)
 
-        try:
-            self.channel.basic_publish(
-                exchange='',
-                routing_key=self.queue_name,
-                body=message,
-                properties=pika.BasicProperties(
-                    delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE
-                )
-            )
-            return True
-        except (pika.exceptions.AMQPError, json.JSONDecodeError) as e:
-            logging.error(f"Failed to send message: {e}")
-            return False
-
-    async def get(self, ack: bool = False) -> Optional[MessageType]:
+    async def push_string(self, message: str) -> bool:
         """
-        Get a single message from the queue.
+        Push a string to the queue.
 
         Args:
-            :param ack: If True, automatically acknowledge receipt
+            message: String to send
 
         Returns:
-            Optional dictionary with message content or None if queue is empty
+            bool: True if message was sent successfully
         """
+        return await self.publish(message.encode(), 'text/plain')
+
+    async def next_message(self, ack: bool) -> AbstractIncomingMessage:
+        # The broker pushes up to `prefetch` unacknowledged messages into the
+        # local buffer, so waiting here costs no polling round trips.
+        if self.consumer_tag is None:
+            self.consumer_tag = await self.queue.consume(self.messages.put)
+        message = await self.messages.get()
+        if ack:
+            await message.ack()
+        return message
+
+    async def get(self, ack: bool = False):
+        """
+        Wait for the next message from the queue.
 
-        try:
-            self.channel.queue_declare(queue=self.queue_name, passive=True)
-        except Exception as e1:
-            logging.error(f"Connection not established... Wait connect")
-            while True:
-                try:
-                    self.connect()
-                    if self.channel and self.channel.is_open:
-                        logging.info(f"Connection done")
-                        break
-                except Exception as e:
-                    logging.error(f"Wait connect()")
-                    await asyncio.sleep(GET_TIMEOUT_SECONDS)
-
-        method_frame, properties, body = self.channel.basic_get(
-            queue=self.queue_name,
-            auto_ack=ack
-        )
-
-        if not method_frame:
-            return None
-
-        try:
-            if properties.content_type != 'application/json':
-                raise ValueError("Non-JSON message received")
-
-            message = json.loads(body.decode())
-            if not isinstance(message, dict):
-                raise ValueError("Message is not a dictionary")
-
-            return message
-
-        except (json.JSONDecodeError, UnicodeDecodeError, ValueError) as e:
-            logging.error(f"Failed to process message: {e}")
-            self.channel.basic_nack(method_frame.delivery_tag, requeue=False)
-            return None
-
-
+        Args:
+            :param ack: If True, acknowledge the message as soon as it is received
 
+        Returns:
+            Tuple of the message dictionary and the message to pass to ack()
+        """
+        while True:
+            message = await self.next_message(ack)
+            try:
+                return load_message(message.body, message.content_type), message
+            except Exception as e:
+                logging.error(f"Failed to process message: {e}")
+                if not ack:
+                    await message.nack(requeue=False)
+
+    async def ack(self, message: AbstractIncomingMessage):
+        await message.ack()
+
+    async def nack(self, message: AbstractIncomingMessage, requeue: bool = True):
+        await message.nack(requeue=requeue)
@@ -0,0 +1,108 @@
+import hashlib
+from typing import FrozenSet, List, Tuple
+from config import *
+
+ALPHABET_BYTES = ALPHABET.encode()
+ALPHABET_CHARS = [bytes([char]) for char in ALPHABET_BYTES]
+
+_progress = None
+_cancel = None
+
+
+def init_process(progress, cancel) -> None:
+    global _progress, _cancel
+    _progress = progress
+    _cancel = cancel
+
+
+def cancelled() -> bool:
+    return _cancel is not None and _cancel.value != 0
+
+
+def report_progress(done: int) -> None:
+    if _progress is not None and done:
+        with _progress.get_lock():
+            _progress.value += done
+
+
+def num_to_digits(num: int, length: int) -> List[int]:
+    digits = [0] * length
+    for position in range(length - 1, -1, -1):
+        num, digits[position] = divmod(num, 36)
+    return digits
+
+
+def num_to_word(num: int, length: int) -> str:
+    return ''.join(ALPHABET[digit] for digit in num_to_digits(num, length))
+
+
+def part_range(total: int, part_number: int, part_count: int) -> Tuple[int, int]:
+    per_part, rem = divmod(total, part_count)
+    if part_number < rem:
+        start = part_number * (per_part + 1)
+        end = start + (per_part + 1)
+    else:
+        start = rem * (per_part + 1) + (part_number - rem) * per_part
+        end = start + per_part
+    return start, end
+
+
+def split_range(start: int, end: int, count: int) -> List[Tuple[int, int]]:
+    ranges = []
+    for number in range(count):
+        sub_start, sub_end = part_range(end - start, number, count)
+        if sub_start != sub_end:
+            ranges.append((start + sub_start, start + sub_end))
+    return ranges
+
+
+def search_range(targets: FrozenSet[bytes], length: int, start: int, end: int) -> List[str]:
+    # Words are numbered with the last character as the lowest digit, so the
+    # range is walked like an odometer: md5 states of every prefix are kept and
+    # only the states right of a carry get rehashed.
+    results: List[str] = []
+    digits = num_to_digits(start, length)
+    word = bytearray(ALPHABET_BYTES[digit] for digit in digits)
+    states = [hashlib.md5()]
+    for position in range(length - 1):
+        state = states[position].copy()
+        state.update(word[position:position + 1])
+        states.append(state)
+
+    remaining = end - start
+    done = 0
+    last = digits[-1]
+    while remaining > 0:
+        prefix = states[-1]
+        stop = min(36, last + remaining)
+        for char in ALPHABET_CHARS[last:stop]:
+            state = prefix.copy()
+            state.update(char)
+            if state.digest() in targets:
+                word[-1] = char[0]
+                results.append(word.decode())
+        remaining -= stop - last
+        done += stop - last
+        last = 0
+        if done >= PROGRESS_STEP:
+            report_progress(done)
+            done = 0
+            if cancelled():
+                break
+
+        position = length - 2
+        while position >= 0:
+            digits[position] += 1
+            if digits[position] < 36:
+                break
+            digits[position] = 0
+            position -= 1
+        if position < 0:
+            break
+        for changed in range(position, length - 1):
+            word[changed] = ALPHABET_BYTES[digits[changed]]
+            state = states[changed].copy()
+            state.update(word[changed:changed + 1])
+            states[changed + 1] = state
+    report_progress(done)
+    return results
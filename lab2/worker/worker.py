@@ -1,11 +1,20 @@
+import aiohttp
 from aiohttp import web
 import hashlib
-import xml.etree.ElementTree as ET
 import asyncio
+import time
+import json
+import multiprocessing
 import requests
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
 from config import *
 from rebbit import RabbitMQClient
+from protocol import MSGPACK_CONTENT_TYPE, checkpoint_to_xml, dump_results, result_to_xml
+from search import init_process, num_to_word, split_range, search_range
+from md5_numpy import search_range_numpy, verify_numpy_engine
+from digest_index import DigestIndex
 import logging
 
 logging.basicConfig(
@@ -18,64 +27,217 @@ class WorkerHelper:
         self.current_tasks: int = 0
         self.total_tasks: int = 0
         self.worker_results_queue = worker_results_queue
+        self.checkpoint: int = 0
+        self.results: Dict[Tuple[str, int], list] = {}
+        self.checkpoints: List[Tuple[List[str], int, int, int]] = []
+        self.unconfirmed: bool = False
+        self.search = search_range
+        self.step = PROGRESS_STEP
+        if WORKER_ENGINE == 'numpy':
+            if verify_numpy_engine():
+                self.search = search_range_numpy
+                self.step = NUMPY_BLOCK_SIZE
+            else:
+                logging.error("NumPy engine is unavailable or failed verification, using hashlib engine")
+        self.digest_index = DigestIndex()
+        self.digest_index.open()
+        self.cancelled: OrderedDict = OrderedDict()
+        self.current_request_ids: Set[str] = set()
+        self.reported_tasks: int = 0
+        self.checked_total: int = 0
+        self.rate_checked: int = 0
+        self.rate_time: float = time.time()
+        self.hash_rate: float = 0
+        self.progress_deltas: Dict[Tuple[str, ...], int] = {}
+        self.pool = None
+        self.progress = None
+        self.cancel_flag = None
+        if WORKER_PROCESSES > 1:
+            context = multiprocessing.get_context('spawn')
+            self.progress = context.Value('q', 0)
+            self.cancel_flag = context.Value('b', 0)
+            self.pool = ProcessPoolExecutor(
+                max_workers=WORKER_PROCESSES,
+                mp_context=context,
+                initializer=init_process,
+                initargs=(self.progress, self.cancel_flag)
+            )
 
     def num_to_word(self, num: int, length: int) -> str:
-        chars = ""
-        for _ in range(length):
-            num, rem = divmod(num, 36)
-            chars += ALPHABET[rem]
-        return chars
-
-    async def process_task(self, request_id: str, hash_target: str, max_length: int, part_number: int, part_count: int) -> List[str]:
-        results: List[str] = []
+        return num_to_word(num, length)
+
+    def cancel(self, request_ids: List[str]) -> None:
+        for request_id in request_ids:
+            self.cancelled[request_id] = True
+            self.cancelled.move_to_end(request_id)
+        while len(self.cancelled) > CANCELLED_HISTORY:
+            self.cancelled.popitem(last=False)
+        if self.pool and self.is_cancelled(self.current_request_ids):
+            self.cancel_flag.value = 1
+
+    def is_cancelled(self, request_ids) -> bool:
+        request_ids = set(request_ids)
+        return bool(request_ids) and all(request_id in self.cancelled for request_id in request_ids)
+
+    async def process_task(self, targets: Dict[str, str], length: int, start: int, end: int, part_number: int,
+                           part_count: int) -> bool:
+        digests = {bytes.fromhex(hash_target): request_id for hash_target, request_id in targets.items()}
+        target_set = frozenset(digests)
+        self.flush_progress()
+        self.current_request_ids = set(targets.values())
+        self.checkpoint = start
+        self.unconfirmed = False
         self.current_tasks = 0
-        self.total_tasks = 0
-        for length in range(1, max_length + 1):
-            self.total_tasks += 36 ** length
-        self.total_tasks /= part_count
-
-        for length in range(1, max_length + 1):
-            total = 36 ** length
-            per_part, rem = divmod(total, part_count)
-            if part_number < rem:
-                start = part_number * (per_part + 1)
-                end = start + (per_part + 1)
-            else:
-                start = rem * (per_part + 1) + (part_number - rem) * per_part
-                end = start + per_part
-
-            for word_num in range(start, end):
-                word = self.num_to_word(word_num, length)
-                md5 = hashlib.md5(word.encode()).hexdigest()
-                if md5 == hash_target:
-                    await self.send_response(request_id, part_number, part_count, [word], partial=True)
-                self.current_tasks += 1
-                if self.current_tasks % 10000 == 0:
-                    await asyncio.sleep(0)
-        return results
-
-    async def send_response(self, request_id: str, part_number: int, part_count: int, results: List[str], partial: bool = False) -> None:
-        root = ET.Element('CrackResult')
-        ET.SubElement(root, 'RequestId').text = request_id
-        ET.SubElement(root, 'PartNumber').text = str(part_number)
-        ET.SubElement(root, 'PartCount').text = str(part_count)
-
-        results_elem = ET.SubElement(root, 'Results')
-        for res in results:
-            ET.SubElement(results_elem, 'Result').text = res
-
-        if partial:
-            ET.SubElement(root, 'Partial').text = "True"
+        self.reported_tasks = 0
+        self.total_tasks = end - start
+        if self.pool:
+            with self.progress.get_lock():
+                self.progress.value = 0
+            self.cancel_flag.value = 0
+
+        if self.digest_index.has_length(length):
+            for digest in digests:
+                for num in self.digest_index.lookup(digest, length):
+                    if start <= num < end:
+                        self.add_match(digests, num_to_word(num, length), part_number, part_count)
+            self.add_progress(end - start)
+            return True
+
+        if self.pool:
+            await self.process_range_pool(digests, target_set, length, start, end, part_number, part_count)
+            return not self.is_cancelled(self.current_request_ids)
+
+        for sub_start in range(start, end, self.step):
+            sub_end = min(sub_start + self.step, end)
+            for word in self.search(target_set, length, sub_start, sub_end):
+                self.add_match(digests, word, part_number, part_count)
+            self.current_tasks += sub_end - sub_start
+            self.checkpoint = sub_end
+            if sub_end < end:
+                await self.flush_results()
+            await asyncio.sleep(0)
+            if self.is_cancelled(self.current_request_ids):
+                return False
+        return True
+
+    def add_progress(self, count: int) -> None:
+        if self.pool:
+            with self.progress.get_lock():
+                self.progress.value += count
+            self.current_tasks = self.progress.value
+        else:
+            self.current_tasks += count
+
+    def flush_progress(self) -> None:
+        count = self.current_tasks - self.reported_tasks
+        if count > 0:
+            key = tuple(sorted(self.current_request_ids))
+            self.progress_deltas[key] = self.progress_deltas.get(key, 0) + count
+            self.checked_total += count
+        self.reported_tasks = self.current_tasks
+
+    def take_progress(self) -> List[Dict[str, Any]]:
+        self.flush_progress()
+        progress = [{'request_ids': list(request_ids), 'count': count}
+                    for request_ids, count in self.progress_deltas.items()]
+        self.progress_deltas = {}
+        return progress
+
+    def restore_progress(self, progress: List[Dict[str, Any]]) -> None:
+        # Counts that could not be sent go out with the next push.
+        for entry in progress:
+            key = tuple(entry['request_ids'])
+            self.progress_deltas[key] = self.progress_deltas.get(key, 0) + entry['count']
+
+    def measure_hash_rate(self) -> float:
+        # Keeps the last measured rate while idle, so the manager still sees
+        # what the worker is capable of.
+        self.flush_progress()
+        current_time = time.time()
+        checked = self.checked_total - self.rate_checked
+        if checked > 0:
+            self.hash_rate = checked / (current_time - self.rate_time)
+        self.rate_checked = self.checked_total
+        self.rate_time = current_time
+        return self.hash_rate
+
+    async def process_range_pool(self, digests: Dict[bytes, str], target_set: FrozenSet[bytes], length: int,
+                                 start: int, end: int, part_number: int, part_count: int) -> None:
+        # Subranges finish out of order, so the checkpoint only advances over
+        # the prefix of the chunk whose subranges are all done.
+        loop = asyncio.get_running_loop()
+        remaining = split_range(start, end, WORKER_PROCESSES * SUBRANGES_PER_PROCESS)
+        futures = {
+            loop.run_in_executor(self.pool, self.search, target_set, length, sub_start, sub_end): (sub_start, sub_end)
+            for sub_start, sub_end in remaining
+        }
+        completed = set()
+        pending = set(futures)
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=PROGRESS_POLL_SECONDS)
+            self.current_tasks = self.progress.value
+            if self.cancel_flag.value:
+                for future in pending:
+                    future.cancel()
+            for future in done:
+                if future.cancelled():
+                    continue
+                for word in future.result():
+                    self.add_match(digests, word, part_number, part_count)
+                completed.add(futures[future])
+            while remaining and remaining[0] in completed:
+                self.checkpoint = remaining.pop(0)[1]
+            # Hits from the last subranges travel with the completion.
+            if pending:
+                await self.flush_results()
+
+    def add_result(self, request_id: str, part_number: int, part_count: int, results: List[str],
+                   partial: bool = False) -> None:
+        # Hits and the completion of the same part merge into one record
+        # until the next flush_results().
+        key = (request_id, part_number)
+        if key in self.results:
+            record = self.results[key]
+            record[3].extend(results)
+            record[4] = record[4] and partial
         else:
-            ET.SubElement(root, 'Partial').text = "False"
+            self.results[key] = [request_id, part_number, part_count, list(results), partial]
+
+    def add_match(self, digests: Dict[bytes, str], word: str, part_number: int, part_count: int) -> None:
+        request_id = digests[hashlib.md5(word.encode()).digest()]
+        self.add_result(request_id, part_number, part_count, [word], partial=True)
 
-        xml_data = '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding='unicode')
+    async def flush_results(self) -> bool:
+        """Publish everything collected so far; False if the broker did not confirm some of it."""
+        results = [tuple(record) for record in self.results.values()]
+        checkpoints = self.checkpoints
+        if not results and not checkpoints:
+            return True
+        self.results = {}
+        self.checkpoints = []
 
-        logging.info(f"Send result {xml_data}")
+        logging.info(f"Send results {results} checkpoints {checkpoints}")
         try:
-            await self.worker_results_queue.push_string(xml_data)
+            sent = True
+            if MESSAGE_FORMAT == 'msgpack':
+                sent = await self.worker_results_queue.publish(dump_results(results, checkpoints),
+                                                               MSGPACK_CONTENT_TYPE)
+            else:
+                for checkpoint in checkpoints:
+                    sent = await self.worker_results_queue.push_string(checkpoint_to_xml(checkpoint)) and sent
+                for result in results:
+                    sent = await self.worker_results_queue.push_string(result_to_xml(result)) and sent
+            if not sent:
+                self.unconfirmed = True
+            return sent
         except Exception as e:
             logging.error(f"Exception occurred: {e}")
+            self.unconfirmed = True
+            return False
+
+    async def send_checkpoint(self, request_ids: List[str], part_number: int, length: int, offset: int) -> None:
+        self.checkpoints.append((request_ids, part_number, length, offset))
+        await self.flush_results()
 
 class Worker:
     def __init__(self):
@@ -84,7 +246,8 @@ class Worker:
             RABBIT_PORT,
             RABBIT_USER,
             RABBIT_PASS,
-            RABBIT_WORKER_TASK_QUEUE
+            RABBIT_WORKER_TASK_QUEUE,
+            prefetch=RABBIT_TASK_PREFETCH
         )
         self.worker_results_queue = RabbitMQClient(
             RABBIT_HOST,
@@ -93,35 +256,165 @@ class Worker:
             RABBIT_PASS,
             RABBIT_WORKER_RESULTS_QUEUE
         )
-        self.worker_task_queue.connect()
-        self.worker_results_queue.connect()
+        self.progress_queue = RabbitMQClient(
+            RABBIT_HOST,
+            RABBIT_PORT,
+            RABBIT_USER,
+            RABBIT_PASS,
+            RABBIT_WORKER_PROGRESS_QUEUE
+        )
+        self.cancel_queue = RabbitMQClient(
+            RABBIT_HOST,
+            RABBIT_PORT,
+            RABBIT_USER,
+            RABBIT_PASS,
+            '',
+            RABBIT_CANCEL_EXCHANGE
+        )
 
         self.worker_helper = WorkerHelper(self.worker_results_queue)
-        self.part_number = None
+        self.task_data = None
+        self.session: Optional[aiohttp.ClientSession] = None
 
     async def process_task(self) -> None:
+        # The task is acked only after its results are confirmed, so a
+        # worker that dies mid-chunk leaves the chunk to the broker, which
+        # hands exactly that chunk to another worker.
         while True:
+            message = None
             try:
-                task_data = await self.worker_task_queue.get(ack=True)
+                task_data, message = await self.worker_task_queue.get()
                 if not task_data:
+                    await self.worker_task_queue.ack(message)
                     await asyncio.sleep(GET_TIMEOUT_SECONDS)
                     continue
                 logging.info(f"GET TASK {task_data}")
-                request_id = task_data.get('request_id')
-                hash_target = task_data.get('hash')
-                max_length = task_data.get('max_length')
+                targets = task_data.get('targets')
+                length = task_data.get('length')
+                start = task_data.get('start')
+                end = task_data.get('end')
                 part_number = task_data.get('part_number')
                 part_count = task_data.get('part_count')
 
-                self.part_number = part_number
+                if self.worker_helper.is_cancelled(targets.values()):
+                    logging.info(f"Skip cancelled chunk {part_number}")
+                    await self.worker_task_queue.ack(message)
+                    continue
+
+                if message.redelivered:
+                    task_data = await self.resume_task(task_data)
+                    if task_data is None:
+                        logging.info(f"Skip finished chunk {part_number}")
+                        await self.worker_task_queue.ack(message)
+                        continue
+                    start = task_data['start']
 
-                results = await self.worker_helper.process_task(request_id, hash_target, max_length, part_number,
-                                                                part_count)
+                self.task_data = task_data
 
-                await self.worker_helper.send_response(request_id, part_number, part_count, results)
+                if await self.worker_helper.process_task(targets, length, start, end, part_number, part_count):
+                    for request_id in targets.values():
+                        self.worker_helper.add_result(request_id, part_number, part_count, [])
+                # A lost mid-chunk message may have carried a hit, so the
+                # whole chunk is redone rather than acked.
+                if await self.worker_helper.flush_results() and not self.worker_helper.unconfirmed:
+                    await self.worker_task_queue.ack(message)
+                else:
+                    logging.error(f"Results of chunk {part_number} were not confirmed, returning it to the queue")
+                    await self.worker_task_queue.nack(message)
+                self.task_data = None
 
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                # A malformed task fails the same way on every worker, so it
+                # is dropped instead of going round the queue forever.
+                logging.error(f"Dropping malformed task: {e}")
+                self.task_data = None
+                if message is not None:
+                    try:
+                        await self.worker_task_queue.nack(message, requeue=False)
+                    except Exception:
+                        pass
             except Exception as e:
                 logging.error(f"Exception worker.process_task {e}")
+                self.task_data = None
+                if message is not None:
+                    try:
+                        await self.worker_task_queue.nack(message)
+                    except Exception:
+                        pass
+                await asyncio.sleep(GET_TIMEOUT_SECONDS)
+
+    async def resume_task(self, task_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # Another worker already ran part of a redelivered chunk; carry on
+        # from its last checkpoint, or from the start if the manager is away.
+        try:
+            async with self.session.post(f"{MANAGER_URL}{MANAGER_CHECKPOINT_URL}", json=task_data) as response:
+                if response.status == 200:
+                    return await response.json()
+                logging.error(f"Error: Received status code {response.status}")
+        except Exception as e:
+            logging.error(f"Exception occurred: {e}")
+        return task_data
+
+    async def checkpoint_loop(self) -> None:
+        last_checkpoint = None
+        while True:
+            await asyncio.sleep(CHECKPOINT_SECONDS)
+            task_data = self.task_data
+            if not task_data:
+                continue
+            checkpoint = (task_data['part_number'], self.worker_helper.checkpoint)
+            if checkpoint == last_checkpoint or self.worker_helper.checkpoint <= task_data['start']:
+                continue
+            last_checkpoint = checkpoint
+            await self.worker_helper.send_checkpoint(list(task_data['targets'].values()), task_data['part_number'],
+                                                     task_data['length'], self.worker_helper.checkpoint)
+
+    async def send_heartbeat(self, leaving: bool = False) -> None:
+        heartbeat = {
+            'url': WORKER_URL,
+            'cores': WORKER_PROCESSES,
+            'hash_rate': self.worker_helper.measure_hash_rate(),
+            'task': self.task_data,
+            'done': self.worker_helper.current_tasks,
+            'leaving': leaving
+        }
+        try:
+            async with self.session.post(f"{MANAGER_URL}{MANAGER_HEARTBEAT_URL}", json=heartbeat) as response:
+                if response.status != 200:
+                    logging.error(f"Error: Received status code {response.status}")
+        except Exception as e:
+            logging.error(f"Exception occurred: {e}")
+
+    async def heartbeat(self) -> None:
+        while True:
+            await self.send_heartbeat()
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+
+    async def report_progress(self) -> None:
+        while True:
+            await asyncio.sleep(PROGRESS_PUSH_SECONDS)
+            progress = self.worker_helper.take_progress()
+            if not progress:
+                continue
+            try:
+                sent = await self.progress_queue.push({'progress': progress})
+            except Exception as e:
+                logging.error(f"Exception worker.report_progress {e}")
+                sent = False
+            if not sent:
+                self.worker_helper.restore_progress(progress)
+
+    async def process_cancellations(self) -> None:
+        while True:
+            try:
+                cancel_data, _ = await self.cancel_queue.get(ack=True)
+                if not cancel_data:
+                    await asyncio.sleep(GET_TIMEOUT_SECONDS)
+                    continue
+                logging.info(f"CANCEL {cancel_data}")
+                self.worker_helper.cancel(cancel_data.get('request_ids', []))
+            except Exception as e:
+                logging.error(f"Exception worker.process_cancellations {e}")
                 await asyncio.sleep(GET_TIMEOUT_SECONDS)
 
     async def handle_progress(self, request: web.Request) -> web.Response:
@@ -132,11 +425,34 @@ class Worker:
             return web.Response(text=f"0")
 
     async def health_check(self, request: web.Request) -> web.Response:
-        return web.Response(text=f"{self.part_number}")
+        return web.Response(text=json.dumps(self.task_data))
 
     async def start_background_tasks(self, app: web.Application) -> None:
+        # One session for every heartbeat, so they reuse a pooled keep-alive
+        # connection to the manager.
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=MANAGER_TIMEOUT_SECONDS))
+        await self.worker_task_queue.connect()
+        await self.worker_results_queue.connect()
+        await self.progress_queue.connect()
+        await self.cancel_queue.connect()
         app['process_task'] = asyncio.create_task(self.process_task())
+        app['process_cancellations'] = asyncio.create_task(self.process_cancellations())
+        app['checkpoint_loop'] = asyncio.create_task(self.checkpoint_loop())
+        app['report_progress'] = asyncio.create_task(self.report_progress())
+        app['heartbeat'] = asyncio.create_task(self.heartbeat())
 
     async def cleanup_background_tasks(self, app: web.Application) -> None:
-        app['process_task'].cancel()
-        await app['process_task']
+        await self.send_heartbeat(leaving=True)
+        try:
+            app['process_task'].cancel()
+            await app['process_task']
+            app['process_cancellations'].cancel()
+            await app['process_cancellations']
+            app['checkpoint_loop'].cancel()
+            await app['checkpoint_loop']
+            app['report_progress'].cancel()
+            await app['report_progress']
+            app['heartbeat'].cancel()
+            await app['heartbeat']
+        finally:
+            await self.session.close()